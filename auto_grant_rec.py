@@ -36,11 +36,40 @@ Install Python3 package prerequities by
   https://chromedriver.chromium.org/downloads
 - Unzip the downloaded package and note the path to the chromedriver
   e.g. '/Users/ChanTaiMan/Downloads/chromedriver'
+- Before loading the input, the script checks that chromedriver and Chrome
+  have the same major version and stops at once if not. The versions are
+  cached in `~/.cache/auto_grant_rec` until either binary changes.
+  `--skip_driver_check` skips the check.
 
 ## Usage
 - `python3 auto_grant_rec.py -u USER_ID -p PASSWD -n "CHAN, Tai-man"
    -c /path/to/chromedriver -i yourinput.xlsx`
 
+- To fill from an institution-wide register, build a PI-partitioned store
+  once with `auto_grant_rec_store.py` and pass the store directory as input:
+  `python3 auto_grant_rec.py -u USER_ID -p PASSWD -n "CHAN, Tai-man"
+   -c /path/to/chromedriver -i grant_store`
+
+- The input can also be a CSV, JSON-lines or Parquet file with the columns
+  of the template in one table, e.g. `-i yourinput.csv`. The format is taken
+  from the extension or given by `--input_format`. Only Excel input needs
+  `pandas`, `xlrd` and `openpyxl`.
+
+- `--spec grant_record_spec.json` fills from a declarative form spec with
+  `auto_grant_rec_spec.py` instead of the built-in field logic.
+
+- `--watch` keeps the browser open after filling and pushes only the
+  changed records online whenever the input file is saved, until Ctrl-C.
+  Install `watchdog` to be notified of changes instead of polling.
+
+- `auto_grant_rec_plan.py` predicts the wall time of runs from the JSON
+  logs of earlier runs. Pass its plan by `--plan` to log the actual wall
+  time against the prediction.
+
+- To fill with Firefox, add `--browser firefox` and pass the path to
+  geckodriver by `-c`. `auto_grant_rec_bench.py` compares the speed of the
+  available browsers on a local stand-in of the online system.
+
 ## Remarks
 - This script first CLEARS any existing record in the online system before 
   filling the form according to your input file. Please make sure your input 
@@ -50,6 +79,36 @@ Install Python3 package prerequities by
 - The browsing may stuck, e.g. at the proposal menu, in some rare occasions due
   to browser request timing issue. Just rerun the script and this should be
   solved.
+- `--clear bulk` lists the old records once and deletes them by script calls
+  instead of re-reading all buttons before every deletion.
+- `--verify deferred` skips reading back every field while filling. All saved
+  records are read back in bulk afterwards and compared with the input;
+  mismatched or missing records are re-submitted with inline checks. Reading
+  a record back takes two more page loads, opening it and returning to the
+  list, while inline checks load no page. Deferred verification therefore
+  only pays off where reading fields through the driver is slower than two
+  page loads, e.g. over a remote driver. Compare both on the stand-in server
+  by `auto_grant_rec_bench.py --verify inline` and `--verify deferred`.
+- Records are left through the Proposal Menu button when the record form
+  shows it, and through the browser history otherwise, which may show an
+  expired page after a record was saved.
+- `--readiness observer` waits for each page inside the browser with DOM
+  observers instead of polling the driver every 500 ms, so that the next
+  step starts as soon as the page is usable. Use `--verbose` to log the
+  time spent waiting for each page.
+- The run log (`-l`) is written as JSON lines with the PI, record and field
+  of each message by a background thread. Use `--log_format text` for plain
+  lines, `--verbose` for debug messages, and e.g. `--log_level fill=WARNING
+  --log_level selenium=WARNING` to set the verbosity per component.
+- `--profile` counts and times every WebDriver command by type, call site
+  and run phase, and writes a JSON report next to the run log. Add
+  `--profile_python` to include the Python hot spots found by cProfile.
+- The browser is closed at the end of each run, also when the run fails or
+  is stopped by SIGTERM.
+- For long runs, `--recycle_after RECORDS` and `--recycle_rss MB` restart the
+  browser after a number of records or above a memory limit. An unresponsive
+  browser is restarted as well. The new browser logs in again and continues
+  on the grant record page.
 - Note that the headless mode skips showing the browser pop-up to free up the
   screen, runs faster, but has a higher chance of Timeout error.
 
@@ -80,233 +139,1011 @@ __version__ = '1.3'
 __license__ = "MIT License"
 
 from selenium import webdriver
-from selenium.webdriver.chrome.webdriver import WebDriver
-from selenium.webdriver.chrome import service as fs
-from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.select import Select
 from selenium.common.exceptions import StaleElementReferenceException, \
-    ElementNotInteractableException
-import pandas as pd
+    ElementNotInteractableException, JavascriptException, TimeoutException, \
+    WebDriverException
+import atexit
+import collections
+import contextlib
+import contextvars
+import copy
+import cProfile
+import csv
 import datetime
+import json
 import logging
+import logging.handlers
 import argparse
+import io
+import os
+import platform
+import pstats
+import queue
+import re
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 
-### Set input arguments ###
+### Constants ###
+login_url = 'https://cerg1.ugc.edu.hk/cergprod/login.jsp'
+form_url = 'https://cerg1.ugc.edu.hk/cergprod/' + \
+           'ControlServlet?FunctionName=UF501&FunctionID=SCRUM501_12' + \
+           '&action_type=GOTO&seq=867705'
+# '&seq=' prevents directly entering the page
 
+add_proj_xpath = "//input[@value=' Add Project / Work " + \
+                 "(GRF/ECS & non-GRF/non-ECS) ']"
+min_refno_len = 6
+role_dict = {'PI': 'P', 'PC': 'PC', 'Co-I': 'C', 'Co-PI': 'Co-PI', 0: ''}
+proj_status = {"On-going": "O", "Completed": "Z", "Pending": "U"}
 
-def fill_rgc():
-    parser = argparse.ArgumentParser(description='Parse user ID, password ' +
-                                                 'and grant record Excel file '+
-                                                 'to the GRF application for '
-                                                 'auto form filling.')
-    parser.add_argument('-u', '--user_id', metavar='USER_ID', type=str,
-                        required=True, help='User ID')
-    parser.add_argument('-p', '--pw', metavar='PASSWD', type=str,
-                        required=True, help='Password')
-    parser.add_argument('-i', '--input', metavar='EXCEL_FILE_PATH', type=str,
-                        required=True, help='Input Excel file')
-    parser.add_argument('-n', '--pi_name', metavar='PI_NAME', type=str,
-                        required=True,
-                        help='PI name. Add double quotes, e.g. "Chan, Tai-man"')
-    parser.add_argument('-c', '--chromedriver_path',
-                        metavar='CHROME_DRIVER_PATH',
-                        type=str, default='chromedriver',
-                        help='path to chromedriver')
-    parser.add_argument('-l', '--log_path', metavar='LOG_FILE_PATH', type=str,
-                        default=datetime.datetime.now().strftime(
-                                '%Y%m%d-%H%M%S') + '-rgc-grantrec.log',
-                        help='path to run log')
-    parser.add_argument('--verbose', nargs='?')
-    parser.add_argument('--version', '-v', action='version',
-                        version='%(prog)s ' + __version__)
-    parser.add_argument('--headless', nargs='?', const=True,
-                        help='Add this argument to skip showing the browser')
-    args = parser.parse_args()
+# Grant record form field names by input code
+form_fields = {'NPI': 'piName', 'CAP': 'capacity', 'FSF': 'fund_src_flag',
+               'FSR': 'fund_src', 'STA': 'proj_status', 'RNO': 'ref_no',
+               'PTI': 'proj_title', 'FAM': 'fund_amt', 'RGC': 'ugcfunding',
+               'SDA': 's_day', 'SMO': 's_month', 'SYR': 's_year',
+               'CDA': 'c_day', 'CMO': 'c_month', 'CYR': 'c_year',
+               'NHR': 'workHourPer', 'OBJ': 'projectObjective'}
 
+# Text fields of the grant record form, typed character by character
+text_form_fields = ['piName', 'fund_src', 'ref_no', 'proj_title', 'fund_amt',
+                    'workHourPer', 'projectObjective']
 
-    ### Initialize logger ###
-    log_filename = args.log_path
-    if not args.verbose:
-        logging.basicConfig(filename=log_filename, level=logging.INFO)
-    elif args.verbose == 1:
-        logging.basicConfig(filename=log_filename, level=logging.DEBUG)
+# Collects the record buttons and their values in a single round-trip
+record_buttons_js = """
+var buttons = document.querySelectorAll("input[type='button']");
+var found = [];
+for (var i = 0; i < buttons.length; i++) {
+    var value = buttons[i].value.trim();
+    if (value.length >= arguments[0] && value.indexOf('Objective') < 0
+            && value.indexOf('Project') < 0) {
+        found.push([buttons[i], value]);
+    }
+}
+return found;
+"""
+
+# Opens the record behind the n-th record button and returns its value
+click_record_js = """
+var buttons = document.querySelectorAll("input[type='button']");
+var n = 0;
+for (var i = 0; i < buttons.length; i++) {
+    var value = buttons[i].value.trim();
+    if (value.length >= arguments[0] && value.indexOf('Objective') < 0
+            && value.indexOf('Project') < 0) {
+        if (n === arguments[1]) {
+            buttons[i].click();
+            return value;
+        }
+        n++;
+    }
+}
+return null;
+"""
+
+# Deletes the opened record. The confirmation dialog is answered in-page,
+# which saves the round-trips of switching to and accepting the alert
+delete_record_js = """
+window.confirm = function () { return true; };
+window.alert = function () {};
+document.getElementsByName('del')[0].click();
+"""
+
+# Reads back all submittable values of the opened record form at once.
+# Radio buttons are reported by their id suffix, e.g. ugcfunding_Y -> Y
+read_form_js = """
+var form = document.getElementsByName('piName')[0].form;
+var values = {};
+for (var i = 0; i < form.elements.length; i++) {
+    var el = form.elements[i];
+    if (!el.name || el.disabled) continue;
+    if (el.type === 'radio') {
+        if (el.checked) {
+            values[el.name] = el.id.indexOf(el.name + '_') === 0 ?
+                el.id.substring(el.name.length + 1) : el.value;
+        }
+    } else if (el.type !== 'button' && el.type !== 'submit') {
+        values[el.name] = el.value;
+    }
+}
+return values;
+"""
+
+# Resolves as soon as the located element is usable, i.e. present, visible
+# and enabled in a document that has finished parsing. Instead of polling,
+# it re-checks on DOM mutations and document readiness changes.
+ready_js = """
+var by = arguments[0], value = arguments[1], timeout = arguments[2];
+var done = arguments[arguments.length - 1];
+var finished = false, observer = null, timer = null;
+function find() {
+    if (by === 'name') return document.getElementsByName(value)[0];
+    if (by === 'id') return document.getElementById(value);
+    if (by === 'link text') {
+        // Whitespace is collapsed as in the visible text Selenium compares
+        var links = document.getElementsByTagName('a');
+        for (var i = 0; i < links.length; i++) {
+            if (links[i].textContent.replace(/\\s+/g, ' ').trim() === value)
+                return links[i];
+        }
+        return null;
+    }
+    if (by === 'xpath') {
+        return document.evaluate(value, document, null,
+            XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+    }
+    return document.querySelector(value);
+}
+function usable() {
+    if (document.readyState === 'loading') return false;
+    var el = find();
+    return !!el && !el.disabled && el.getClientRects().length > 0
+        && window.getComputedStyle(el).visibility !== 'hidden';
+}
+function finish(result) {
+    if (finished) return;
+    finished = true;
+    if (observer) observer.disconnect();
+    document.removeEventListener('readystatechange', check);
+    clearTimeout(timer);
+    done(result);
+}
+function check() {
+    if (usable()) finish(true);
+}
+if (usable()) {
+    finish(true);
+} else {
+    observer = new MutationObserver(check);
+    observer.observe(document, {childList: true, subtree: true,
+                                attributes: true});
+    document.addEventListener('readystatechange', check);
+    timer = setTimeout(function () { finish(false); }, timeout);
+}
+"""
+
+### Logging ###
+# Each engine component logs to its own child logger, so that its verbosity
+# can be set separately with --log_level COMPONENT=LEVEL
+log_components = ['data', 'login', 'clear', 'fill', 'verify', 'ready',
+                  'worker']
+logger = logging.getLogger('auto_grant_rec')
+data_logger = logging.getLogger('auto_grant_rec.data')
+login_logger = logging.getLogger('auto_grant_rec.login')
+clear_logger = logging.getLogger('auto_grant_rec.clear')
+fill_logger = logging.getLogger('auto_grant_rec.fill')
+verify_logger = logging.getLogger('auto_grant_rec.verify')
+ready_logger = logging.getLogger('auto_grant_rec.ready')
+worker_logger = logging.getLogger('auto_grant_rec.worker')
+
+# Job/PI/record context of the current thread, attached to every log record
+log_context = contextvars.ContextVar('log_context', default={})
+# Optional record attributes passed through `extra` and kept in JSON lines
+log_extra_keys = ['field', 'phase', 'elapsed', 'records', 'chars',
+                  'predicted']
+
+
+def set_log_context(**context):
+    """Add job/PI/record context to the log records of the current thread."""
+    merged = dict(log_context.get())
+    merged.update(context)
+    log_context.set(merged)
+
+
+class ContextFilter(logging.Filter):
+    def filter(self, record):
+        record.context = log_context.get()
+        return True
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler leaving the formatting to the listener thread.
+
+    The stock handler formats each record on the calling thread and merges
+    the traceback into the message. Here only the message arguments are
+    resolved, as they may change once the call returns, and the exception
+    info is kept for the formatters of the listener.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """Format log records as JSON lines carrying their context."""
+
+    def format(self, record):
+        entry = {'time': datetime.datetime.fromtimestamp(record.created)
+                 .isoformat(timespec='milliseconds'),
+                 'level': record.levelname,
+                 'logger': record.name,
+                 'thread': record.threadName,
+                 'message': record.getMessage()}
+        entry.update(getattr(record, 'context', {}))
+        for key in log_extra_keys:
+            if hasattr(record, key):
+                entry[key] = getattr(record, key)
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def log_level_arg(value):
+    """Check a --log_level COMPONENT=LEVEL argument."""
+    name, sep, level = value.partition('=')
+    if not sep or not name:
+        raise argparse.ArgumentTypeError("expected COMPONENT=LEVEL, got '" +
+                                         value + "'")
+    if not isinstance(logging.getLevelName(level.upper()), int):
+        raise argparse.ArgumentTypeError("unknown log level '" + level +
+                                         "', expected one of DEBUG, INFO, "
+                                         "WARNING, ERROR or CRITICAL")
+    return value
+
+
+def setup_logging(log_path, verbose=0, log_format='json', log_levels=()):
+    """
+    Route all logging through a queue to a background writer thread.
+
+    The threads driving the browser only enqueue records; formatting and
+    writing to the log file and console happen on the listener thread.
+    `log_levels` holds 'COMPONENT=LEVEL' overrides, where COMPONENT is one of
+    `log_components` or any other logger name, e.g. 'selenium'.
+    Returns the started QueueListener, which is stopped at exit.
+    """
+    file_handler = logging.FileHandler(log_path, encoding='utf-8')
+    if log_format == 'json':
+        file_handler.setFormatter(JsonFormatter())
+    else:
+        file_handler.setFormatter(logging.Formatter(
+            "%(asctime)s [%(threadName)-12.12s] [%(levelname)-5.5s]  "
+            "%(message)s"))
     logFormatter = logging.Formatter("%(asctime)s [%(threadName)-12.12s] " +
                                      "[%(levelname)-5.5s]  %(message)s")
-    logger = logging.getLogger()
     consoleHandler = logging.StreamHandler()
     consoleHandler.setFormatter(logFormatter)
-    logger.addHandler(consoleHandler)
 
-    logger.debug(args)
+    log_queue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter())
+    root_logger = logging.getLogger()
+    root_logger.addHandler(queue_handler)
+    root_logger.setLevel(logging.DEBUG if verbose else logging.INFO)
+    for log_level in log_levels:
+        name, _, level = log_level.partition('=')
+        if name in log_components:
+            name = 'auto_grant_rec.' + name
+        logging.getLogger(name).setLevel(level.upper())
 
-    ### Prepare URL ###
-    login_url = 'https://cerg1.ugc.edu.hk/cergprod/login.jsp'
-    form_url = 'https://cerg1.ugc.edu.hk/cergprod/' + \
-               'ControlServlet?FunctionName=UF501&FunctionID=SCRUM501_12' + \
-               '&action_type=GOTO&seq=867705'
-    # '&seq=' prevents directly entering the page
+    listener = logging.handlers.QueueListener(log_queue, file_handler,
+                                              consoleHandler)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
 
-    ### Prepare data ###
-    df = pd.concat(pd.read_excel(args.input,
+
+### Input adapters ###
+# Each adapter returns the rows of the input as dicts keyed by the column
+# names of grant_record_template.xlsx. Missing values are NaN and dates are
+# datetimes, as pandas reads them from the template.
+input_formats = {'.xlsx': 'excel', '.xls': 'excel', '.xlsm': 'excel',
+                 '.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl',
+                 '.parquet': 'parquet', '.pq': 'parquet'}
+date_columns = ['Start date', 'End date']
+# Reference numbers are included as Excel reads numeric ones as numbers
+number_columns = ['Amount (HK$)', 'Number of hours', 'Reference number']
+
+
+def is_missing(value):
+    """True for None, NaN and NaT."""
+    return value is None or value != value
+
+
+def normalize_row(row):
+    """
+    Give a row read from a text format the value types of the template.
+
+    Empty and null values become NaN, dates given as ISO strings or as dates
+    become datetimes and numbers given as strings become ints or floats.
+    """
+    normalized = {}
+    for column, value in row.items():
+        if isinstance(value, str):
+            value = value.strip()
+        if is_missing(value) or value == '':
+            value = float('nan')
+        elif column in date_columns and isinstance(value, str):
+            value = datetime.datetime.fromisoformat(value)
+        elif column in date_columns and \
+                isinstance(value, datetime.date) and \
+                not isinstance(value, datetime.datetime):
+            value = datetime.datetime.combine(value, datetime.time())
+        elif column in number_columns and isinstance(value, str):
+            try:
+                value = int(value)
+            except ValueError:
+                try:
+                    value = float(value)
+                except ValueError:
+                    pass
+        normalized[column] = value
+    return normalized
+
+
+def read_excel_rows(input_path):
+    import pandas as pd
+    df = pd.concat(pd.read_excel(input_path,
                                  sheet_name=['On-going', 'Completed',
                                              'Pending']))
-    df = df.loc[df['End date'] >= datetime.datetime.strptime(
-        str(datetime.datetime.now().year - 4) + '-10-01', '%Y-%m-%d')].\
-        reset_index(drop=True)
-    df = df.loc[~df['Role'].isna()]
+    return df.to_dict('records')
 
-    ### Prepare browser worker ###
-    chrome_options = Options()
-    # chrome_options.add_argument("--user-data-dir=chrome-data")
-    chrome_options.add_argument("--no-sandbox")
-    chrome_options.add_argument("--lang=us")
-    if args.headless:
-        chrome_options.add_argument("--headless")
-
-    chrome_service = fs.Service(executable_path=args.chromedriver_path)
-    driver: WebDriver = webdriver.Chrome(options=chrome_options,
-                                         service=chrome_service)
-    driver.delete_all_cookies()
-    wait = WebDriverWait(driver, 10)
-
-    ### Log in ###
-    timestamp = datetime.datetime.now().strftime('%Y/%m/%d %H:%M:%S')
-    logger.info(timestamp)
-
-    driver.get(login_url)
-    wait.until(EC.element_to_be_clickable((By.NAME, 'submit')))
-    logger.info('Login page loaded')
-
-    input_userid = driver.find_element(By.XPATH, "//input[@maxlength='20']")
-    input_userid.send_keys(args.user_id)
-    logger.info('User ID filled.')
-
-    pwd_filled = False
-    while not pwd_filled:
-        try:
-            input_pwd = driver.find_element(By.XPATH, 
-                "//input[@type='password']")
-            input_pwd.send_keys(args.pw)
-            logger.info('User Password input filled.')
-            pwd_filled = True
-        except StaleElementReferenceException:
-            logger.debug(
-                "WARNING: Stale Element Reference (Password). Retrying.")
-        except ElementNotInteractableException:
-            logger.debug(
-                "WARNING: ElementNotInteractable (Password). Retrying.")
-
-    driver.find_element(By.NAME, "submit").click()
-    logger.info("Login request submitted.")
-
-    ### Select role ###
-    wait.until(EC.element_to_be_clickable((By.NAME, "Continue")))
-    driver.find_element(By.NAME, "Continue").click()
-    logger.info("User role selected.")
-
-    wait.until(EC.element_to_be_clickable(
-        (By.LINK_TEXT, "Prepare Proposal / View Internal Comments")))
-    logger.info("Project maintenance page loaded.")
-
-    main_window = driver.current_window_handle
-    logger.debug(main_window)
-    driver.find_element(By.LINK_TEXT,
-        "Prepare Proposal / View Internal Comments").click()
-    logger.info("Prepare Proposal clicked.")
-    logger.debug(driver.window_handles)
-    driver.switch_to.window(driver.window_handles[1])
-    wait.until(EC.element_to_be_clickable((By.NAME, "yes"))) # value: "I accept"
-    driver.find_element(By.NAME, "yes").click()
-    logger.info("Terms accepted.")
-    driver.switch_to.window(main_window)
-    wait.until(EC.element_to_be_clickable((By.NAME, "ProposalMenu")))
-    driver.find_element(By.NAME, "ProposalMenu").click()
-    driver.find_element(By.LINK_TEXT,
-        "Grant Record and Related Research Work of Investigator(s)").click()
-    wait.until(EC.element_to_be_clickable(
-        (By.XPATH,"//input[@value=' Add Project / Work " +
-         "(GRF/ECS & non-GRF/non-ECS) ']")))
-
-    min_refno_len = 6
-
-    ### Clean all old entries ###
-    cleared = False
-    while not cleared:
-        wait.until(EC.element_to_be_clickable(
-            (By.XPATH, "//input[@value=' Add Project / Work " +
-                       "(GRF/ECS & non-GRF/non-ECS) ']")))
-        buttons = driver.find_elements(By.XPATH, "//input[@type='button']")
-        button_value = buttons[0].get_attribute('value').strip()
-        if len(button_value) >= min_refno_len \
-                and 'Objective' not in button_value \
-                and 'Project' not in button_value:
-            buttons[0].click()
-            wait.until(EC.element_to_be_clickable((By.NAME, 'piName')))
-            driver.find_element(By.NAME, 'del').click()
-            driver.switch_to.alert.accept()
+
+def read_csv_rows(input_path):
+    with open(input_path, newline='', encoding='utf-8-sig') as f:
+        return [normalize_row(row) for row in csv.DictReader(f)]
+
+
+def read_jsonl_rows(input_path):
+    with open(input_path, encoding='utf-8') as f:
+        return [normalize_row(json.loads(line)) for line in f if line.strip()]
+
+
+def read_parquet_rows(input_path):
+    import pyarrow.parquet as pq
+    # ParquetFile.read, unlike read_table, does not import pandas to
+    # interpret the pandas metadata of files written by DataFrame.to_parquet
+    table = pq.ParquetFile(input_path, memory_map=True).read()
+    return [normalize_row(row) for row in table.to_pylist()]
+
+
+def read_store_rows(input_path, pi_name):
+    import auto_grant_rec_store
+    table = auto_grant_rec_store.load_pi_slice(input_path, pi_name)
+    return [normalize_row(row) for row in table.to_pylist()]
+
+
+input_readers = {'excel': read_excel_rows, 'csv': read_csv_rows,
+                 'jsonl': read_jsonl_rows, 'parquet': read_parquet_rows}
+
+
+def input_format(input_path, fmt='auto'):
+    """Input format given, or guessed from the path."""
+    if fmt != 'auto':
+        return fmt
+    if os.path.isdir(input_path):
+        return 'store'
+    ext = os.path.splitext(input_path)[1].lower()
+    if ext not in input_formats:
+        raise ValueError("Unknown input format of " + input_path +
+                         ". Please choose one with --input_format.")
+    return input_formats[ext]
+
+
+def load_records(input_path, pi_name, fmt='auto'):
+    """
+    Load the grant records to fill.
+
+    The input is an Excel workbook like the template, a CSV, JSON-lines or
+    Parquet file with the same columns and one 'Status' column, or a
+    PI-partitioned store built by `auto_grant_rec_store.py` of which only
+    the slice of `pi_name` is read. Only the Excel format needs pandas.
+    """
+    fmt = input_format(input_path, fmt)
+    if fmt == 'store':
+        rows = read_store_rows(input_path, pi_name)
+    else:
+        rows = input_readers[fmt](input_path)
+    cutoff = datetime.datetime.strptime(
+        str(datetime.datetime.now().year - 4) + '-10-01', '%Y-%m-%d')
+    return [row for row in rows
+            if not is_missing(row['End date']) and row['End date'] >= cutoff
+            and not is_missing(row['Role'])]
+
+
+def build_inputdict(row, pi_name):
+    """Translate one record row into form values keyed by input code."""
+    inputdict = {}
+    inputdict["NPI"] = pi_name
+    inputdict["CAP"] = role_dict[row["Role"]]  # value: P/PC/C/Co-PI
+    inputdict["FSF"] = ["N", "Y"][row['Funding source'] == "GRF"]  # Y/N
+    inputdict["FSR"] = row['Funding source']
+    inputdict["STA"] = proj_status[row["Status"]]
+    #inputdict["STA"] = ['Z', 'O'][
+    #    row["End date"] >= datetime.datetime.today()]  # O/Z/U
+    try:
+        # Prevents adding extra .0 as float due to Excel auto-formatting
+        inputdict["RNO"] = str(int(row["Reference number"]))
+        data_logger.warning("Reference number coerced to integer %s. "
+                            "Please check.", inputdict["RNO"])
+    except (ValueError, OverflowError):
+        inputdict["RNO"] = str(row["Reference number"])
+    if inputdict["RNO"] == 'nan':
+        inputdict["RNO"] = ''
+    data_logger.info(inputdict["RNO"], extra={'field': 'ref_no'})
+    inputdict["PTI"] = str(row["Project title"])
+    inputdict["FAM"] = str(row["Amount (HK$)"])
+    inputdict["RGC"] = str(row["UGC/RGC funding"])  # Y/N
+    inputdict["SDA"] = str(row["Start date"].day)
+    inputdict["SMO"] = str(row["Start date"].month)
+    inputdict["SYR"] = str(row["Start date"].year)
+    inputdict["CDA"] = str(row["End date"].day)
+    inputdict["CMO"] = str(row["End date"].month)
+    inputdict["CYR"] = str(row["End date"].year)
+    if inputdict["CAP"] != "C" and inputdict["STA"] != "U":
+        inputdict["NHR"] = str(int(row["Number of hours"]))
+    else:
+        inputdict["NHR"] = 0
+    inputdict["OBJ"] = str(row["Project Objectives"])
+
+    # Funding Amount (HK$) (if not applicable, please input zero)
+    try:
+        inputdict["FAM"] = str(int(float(inputdict["FAM"])))
+    except ValueError:
+        inputdict["FAM"] = 0
+        assert inputdict["STA"] == 'U'
+        data_logger.warning("0 filled for unknown funding amount.")
+
+    # RGC / UGC Funding
+    if inputdict["FSF"] == "Y":
+        assert inputdict["RGC"] == "Y"
+    return inputdict
+
+
+def expected_form_values(inputdict):
+    """Form values a correctly saved record shows, keyed by field name."""
+    expected = {form_fields[code]: str(value)
+                for code, value in inputdict.items()}
+    if inputdict["FSF"] == "Y":
+        del expected[form_fields["FSR"]]
+    if int(float(inputdict["NHR"])) <= 0:
+        del expected[form_fields["NHR"]]
+    return expected
+
+
+def record_chars(values):
+    """Number of characters typed into the text fields of a record."""
+    return sum(len(str(values[name])) for name in text_form_fields
+               if name in values)
+
+
+def diff_form_values(expected, actual):
+    """
+    Compare expected and read-back form values.
+
+    Returns {field name: [expected, actual]} for every mismatch. Fields
+    missing from `actual` because they are disabled on the page are skipped,
+    as the inline mode does.
+    """
+    diff = {}
+    for name, value in expected.items():
+        if name not in actual:
+            if name == form_fields["NHR"]:
+                continue
+            diff[name] = [value, None]
+            continue
+        saved = str(actual[name]).replace('\r\n', '\n')
+        if saved == value.replace('\r\n', '\n'):
+            continue
+        if name == form_fields["FAM"] and saved == '0':
+            continue
+        diff[name] = [value, saved]
+    return diff
+
+
+### Browser backends ###
+
+
+class DriverBackend:
+    """
+    Starts one kind of browser through its WebDriver.
+
+    Subclasses give the Selenium driver, options and service classes, the
+    default driver executable and the browser executables to look for, and
+    may add browser-specific options in `options`.
+    """
+    name = None
+    driver_class = None
+    options_class = None
+    service_class = None
+    driver_name = None
+    browser_names = []
+
+    def options(self, headless=False):
+        return self.options_class()
+
+    def browser_path(self):
+        """Path of the installed browser, or None if not found."""
+        for browser_name in self.browser_names:
+            path = shutil.which(browser_name)
+            if path:
+                return path
+        return None
+
+    def available(self, driver_path=None):
+        return self.browser_path() is not None and \
+               shutil.which(driver_path or self.driver_name) is not None
+
+    def compatible(self, driver_version, browser_version):
+        """Whether the driver version can drive the browser version."""
+        return True
+
+    def resolve(self, driver_path=None):
+        """
+        Find the driver and browser binaries and check that they fit.
+
+        Their versions are probed once and cached by binary path and
+        modification time, so that later runs only stat the binaries.
+        Returns the paths, versions and compatibility. Binaries that are not
+        found locally are None, and their compatibility is not checked.
+        """
+        driver = shutil.which(driver_path or self.driver_name)
+        browser = self.browser_path()
+        resolution = {'backend': self.name, 'driver': driver,
+                      'browser': browser, 'driver_version': None,
+                      'browser_version': None, 'compatible': True,
+                      'cached': False}
+        if not driver or not browser:
+            return resolution
+        binaries = [os.path.realpath(driver), os.path.realpath(browser)]
+        key = '|'.join([self.name] + binaries)
+        mtimes = [os.path.getmtime(path) for path in binaries]
+        cache = read_driver_cache()
+        entry = cache.get(key)
+        if entry and entry['mtimes'] == mtimes:
+            resolution['cached'] = True
         else:
-            buttons = driver.find_elements(By.XPATH, "//input[@type='button']")
-            for button in buttons:
-                button_value = buttons[0].get_attribute('value').strip()
-                assert len(button_value) < min_refno_len \
-                       or 'Objective' in button_value \
-                       or 'Project' in button_value
-            cleared = True
-    logger.info('All old entries cleaned to prepare for new input.')
-
-    ### Input record ###
-    role_dict = {'PI': 'P', 'PC': 'PC', 'Co-I': 'C', 'Co-PI': 'Co-PI', 0: ''}
-    filled_cnt = 0
-
-    for row in df.iterrows():
-        timestamp = datetime.datetime.now().strftime('%Y/%m/%d %H:%M:%S')
-        logger.info(timestamp)
-        inputdict = {}
-        inputdict["NPI"] = args.pi_name
-        inputdict["CAP"] = role_dict[row[1]["Role"]]  # value: P/PC/C/Co-PI
-        inputdict["FSF"] = ["N", "Y"][row[1]['Funding source'] == "GRF"]  # Y/N
-        inputdict["FSR"] = row[1]['Funding source']
-        proj_status = {"On-going": "O", "Completed": "Z", "Pending": "U"}
-        inputdict["STA"] = proj_status[row[1]["Status"]]
-        #inputdict["STA"] = ['Z', 'O'][
-        #    row[1]["End date"] >= pd.Timestamp(datetime.date.today())]  # O/Z/U
+            entry = {'mtimes': mtimes,
+                     'versions': [binary_version(path) for path in binaries]}
+            cache[key] = entry
+            write_driver_cache(cache)
+        resolution['driver_version'], resolution['browser_version'] = \
+            entry['versions']
+        if None not in entry['versions']:
+            resolution['compatible'] = self.compatible(*entry['versions'])
+        return resolution
+
+    def start(self, driver_path=None, headless=False):
+        # Selenium takes the executable path as a file path, so a bare driver
+        # name is looked up on PATH here. If it is not found there either,
+        # Selenium Manager looks for the driver.
+        service = self.service_class(executable_path=shutil.which(
+            driver_path or self.driver_name) or driver_path)
+        return self.driver_class(options=self.options(headless),
+                                 service=service)
+
+
+class ChromeBackend(DriverBackend):
+    name = 'chrome'
+    driver_class = webdriver.Chrome
+    options_class = webdriver.ChromeOptions
+    service_class = webdriver.ChromeService
+    driver_name = 'chromedriver'
+    browser_names = ['google-chrome', 'google-chrome-stable', 'chromium',
+                     'chromium-browser', 'chrome']
+    mac_app = '/Applications/Google Chrome.app/Contents/MacOS/Google Chrome'
+
+    def options(self, headless=False):
+        chrome_options = super().options(headless)
+        # chrome_options.add_argument("--user-data-dir=chrome-data")
+        chrome_options.add_argument("--no-sandbox")
+        chrome_options.add_argument("--lang=us")
+        if headless:
+            chrome_options.add_argument("--headless")
+        return chrome_options
+
+    def browser_path(self):
+        if platform.system() == 'Darwin' and os.path.exists(self.mac_app):
+            return self.mac_app
+        if platform.system() == 'Windows':
+            for root in (os.environ.get('PROGRAMFILES'),
+                         os.environ.get('PROGRAMFILES(X86)'),
+                         os.environ.get('LOCALAPPDATA')):
+                path = os.path.join(root or '', 'Google', 'Chrome',
+                                    'Application', 'chrome.exe')
+                if root and os.path.exists(path):
+                    return path
+        return super().browser_path()
+
+    def compatible(self, driver_version, browser_version):
+        # chromedriver supports the Chrome release of the same major version
+        return driver_version.split('.')[0] == browser_version.split('.')[0]
+
+
+class FirefoxBackend(DriverBackend):
+    name = 'firefox'
+    driver_class = webdriver.Firefox
+    options_class = webdriver.FirefoxOptions
+    service_class = webdriver.FirefoxService
+    driver_name = 'geckodriver'
+    browser_names = ['firefox', 'firefox-esr']
+
+    def options(self, headless=False):
+        firefox_options = super().options(headless)
+        firefox_options.set_preference('intl.accept_languages', 'en-US')
+        if headless:
+            firefox_options.add_argument("-headless")
+        return firefox_options
+
+
+class SafariBackend(DriverBackend):
+    name = 'safari'
+    driver_class = webdriver.Safari
+    options_class = webdriver.SafariOptions
+    service_class = webdriver.SafariService
+    driver_name = '/usr/bin/safaridriver'
+
+    def available(self, driver_path=None):
+        return platform.system() == 'Darwin' and \
+               os.path.exists(driver_path or self.driver_name)
+
+    def start(self, driver_path=None, headless=False):
+        if headless:
+            logger.warning('Safari has no headless mode. Showing the '
+                           'browser.')
+        return super().start(driver_path)
+
+
+backends = {backend.name: backend()
+            for backend in (ChromeBackend, FirefoxBackend, SafariBackend)}
+
+
+def binary_version(path):
+    """Version of a browser or driver binary, e.g. '120.0.6099.109'."""
+    if platform.system() == 'Windows' and \
+            os.path.basename(path).lower() == 'chrome.exe':
+        # chrome.exe prints no version, but installs next to a folder named
+        # after it
+        versions = [entry for entry in os.listdir(os.path.dirname(path))
+                    if re.fullmatch(r'\d+(\.\d+)+', entry)]
+        if not versions:
+            return None
+        return max(versions, key=lambda v: [int(n) for n in v.split('.')])
+    try:
+        output = subprocess.run([path, '--version'], capture_output=True,
+                                text=True, timeout=30).stdout
+    except (OSError, subprocess.SubprocessError) as e:
+        logger.warning('Version of %s not found: %s', path, e)
+        return None
+    match = re.search(r'\d+(\.\d+)+', output)
+    return match.group(0) if match else None
+
+
+def driver_cache_path():
+    cache_dir = os.environ.get('XDG_CACHE_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_dir, 'auto_grant_rec', 'drivers.json')
+
+
+def read_driver_cache():
+    try:
+        with open(driver_cache_path(), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_driver_cache(cache):
+    path = driver_cache_path()
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path),
+                                        suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(cache, f, indent=1)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning('Driver cache not written: %s', e)
+
+
+class DriverMismatchError(RuntimeError):
+    """The driver version does not fit the browser version."""
+
+
+def check_driver(backend, driver_path=None):
+    """
+    Resolve the driver and browser of `backend` and fail fast if their
+    versions do not fit together. Returns the resolution.
+    """
+    start = time.monotonic()
+    resolution = backend.resolve(driver_path)
+    elapsed = (time.monotonic() - start) * 1000
+    if not resolution['driver'] or not resolution['browser']:
+        logger.info('%s or its driver not found locally. Leaving the lookup '
+                    'to Selenium.', backend.name)
+        return resolution
+    logger.info('Driver %s (%s) and browser %s (%s) resolved in %.0f ms%s',
+                resolution['driver'], resolution['driver_version'],
+                resolution['browser'], resolution['browser_version'], elapsed,
+                ' from cache' if resolution['cached'] else '')
+    if not resolution['compatible']:
+        raise DriverMismatchError(
+            'Driver ' + resolution['driver'] + ' version ' +
+            resolution['driver_version'] + ' does not match ' + backend.name +
+            ' version ' + resolution['browser_version'] + ' at ' +
+            resolution['browser'] + '. Please download the driver of the '
+            'same major version and pass its path by -c.')
+    return resolution
+
+
+def process_tree_rss(pid):
+    """
+    Resident memory in bytes of a process and all its descendants, e.g. of
+    a driver together with the browser processes it started.
+    """
+    try:
+        import psutil
+    except ImportError:
+        psutil = None
+    if psutil:
+        try:
+            process = psutil.Process(pid)
+            processes = [process] + process.children(recursive=True)
+        except psutil.NoSuchProcess:
+            return 0
+        rss = 0
+        for process in processes:
+            try:
+                rss += process.memory_info().rss
+            except psutil.NoSuchProcess:
+                pass
+        return rss
+
+    # Without psutil, walk /proc on Linux
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
         try:
-            # Prevents adding extra .0 as float due to Excel auto-formatting
-            inputdict["RNO"] = str(int(row[1]["Reference number"]))
-            logger.warning("Reference number coerced to integer "
-                           + inputdict["RNO"] + ". Please check.")
-        except ValueError:
-            inputdict["RNO"] = str(row[1]["Reference number"])
-        if inputdict["RNO"] == 'nan':
-            inputdict["RNO"] = ''
-        logger.info(inputdict["RNO"])
-        inputdict["PTI"] = str(row[1]["Project title"])
-        inputdict["FAM"] = str(row[1]["Amount (HK$)"])
-        inputdict["RGC"] = str(row[1]["UGC/RGC funding"])  # Y/N
-        inputdict["SDA"] = str(row[1]["Start date"].day)
-        inputdict["SMO"] = str(row[1]["Start date"].month)
-        inputdict["SYR"] = str(row[1]["Start date"].year)
-        inputdict["CDA"] = str(row[1]["End date"].day)
-        inputdict["CMO"] = str(row[1]["End date"].month)
-        inputdict["CYR"] = str(row[1]["End date"].year)
-        if inputdict["CAP"] != "C" and inputdict["STA"] != "U":
-            inputdict["NHR"] = str(int(row[1]["Number of hours"]))
+            with open('/proc/' + entry + '/stat') as f:
+                stat = f.read()
+        except OSError:
+            continue
+        ppid = int(stat[stat.rindex(')') + 2:].split()[1])
+        children.setdefault(ppid, []).append(int(entry))
+    rss = 0
+    pending = [pid]
+    page_size = os.sysconf('SC_PAGE_SIZE')
+    while pending:
+        current = pending.pop()
+        try:
+            with open('/proc/' + str(current) + '/statm') as f:
+                rss += int(f.read().split()[1]) * page_size
+        except OSError:
+            continue
+        pending.extend(children.get(current, []))
+    return rss
+
+
+def driver_rss(driver):
+    """Resident memory in bytes of a driver and its browser processes."""
+    return process_tree_rss(driver.service.process.pid)
+
+
+class RGCSession:
+    """
+    Browser session on the grant record section of the RGC online system.
+
+    `readiness` selects how page transitions are awaited: 'poll' re-checks
+    through WebDriverWait every 500 ms, whereas 'observer' waits inside the
+    page and returns as soon as the element becomes usable. `throttle`, if
+    given, is called before every page transition, e.g. to rate-limit the
+    requests of several sessions to the server.
+    """
+
+    def __init__(self, driver, timeout=10, readiness='poll', throttle=None,
+                 login_url=login_url):
+        self.driver = driver
+        self.login_url = login_url
+        self.timeout = timeout
+        self.readiness = readiness
+        self.throttle = throttle
+        self.wait = WebDriverWait(driver, timeout)
+        if readiness == 'observer':
+            driver.set_script_timeout(timeout + 1)
+
+    def transition(self):
+        """Called right before each request that loads a new page."""
+        if self.throttle:
+            self.throttle()
+
+    def until_clickable(self, by, value):
+        """Wait until the located element can be clicked."""
+        if self.readiness != 'observer':
+            self.wait.until(EC.element_to_be_clickable((by, value)))
+            return
+        start = time.monotonic()
+        deadline = start + self.timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutException("Timed out waiting for " + by + "=" +
+                                       value)
+            try:
+                ready = self.driver.execute_async_script(
+                    ready_js, by, value, int(remaining * 1000))
+            except JavascriptException as e:
+                # The document navigated away while waiting, e.g. right
+                # after a submit. Observe the new document instead.
+                ready_logger.debug("Document unloaded while waiting for "
+                                   "%s: %s", value, e.msg)
+                continue
+            if not ready:
+                raise TimeoutException("Timed out waiting for " + by + "=" +
+                                       value)
+            ready_logger.debug("Ready: %s after %.0f ms", value,
+                               (time.monotonic() - start) * 1000)
+            return
+
+    def login(self, user_id, pw):
+        driver = self.driver
+
+        ### Log in ###
+        self.transition()
+        driver.get(self.login_url)
+        self.until_clickable(By.NAME, 'submit')
+        login_logger.info('Login page loaded')
+
+        input_userid = driver.find_element(By.XPATH,
+                                           "//input[@maxlength='20']")
+        input_userid.send_keys(user_id)
+        login_logger.info('User ID filled.')
+
+        pwd_filled = False
+        while not pwd_filled:
+            try:
+                input_pwd = driver.find_element(By.XPATH,
+                    "//input[@type='password']")
+                input_pwd.send_keys(pw)
+                login_logger.info('User Password input filled.')
+                pwd_filled = True
+            except StaleElementReferenceException:
+                login_logger.debug(
+                    "WARNING: Stale Element Reference (Password). Retrying.")
+            except ElementNotInteractableException:
+                login_logger.debug(
+                    "WARNING: ElementNotInteractable (Password). Retrying.")
+
+        self.transition()
+        driver.find_element(By.NAME, "submit").click()
+        login_logger.info("Login request submitted.")
+
+        ### Select role ###
+        self.until_clickable(By.NAME, "Continue")
+        self.transition()
+        driver.find_element(By.NAME, "Continue").click()
+        login_logger.info("User role selected.")
+
+        self.until_clickable(By.LINK_TEXT,
+                             "Prepare Proposal / View Internal Comments")
+        login_logger.info("Project maintenance page loaded.")
+
+    def open_grant_records(self):
+        driver = self.driver
+
+        main_window = driver.current_window_handle
+        login_logger.debug(main_window)
+        self.transition()
+        driver.find_element(By.LINK_TEXT,
+            "Prepare Proposal / View Internal Comments").click()
+        login_logger.info("Prepare Proposal clicked.")
+        login_logger.debug(driver.window_handles)
+        driver.switch_to.window(driver.window_handles[1])
+        self.until_clickable(By.NAME, "yes")
+        # value: "I accept"
+        self.transition()
+        driver.find_element(By.NAME, "yes").click()
+        login_logger.info("Terms accepted.")
+        driver.switch_to.window(main_window)
+        self.open_record_list()
+
+    def open_record_list(self):
+        """Go to the grant record list through the proposal menu."""
+        driver = self.driver
+        self.until_clickable(By.NAME, "ProposalMenu")
+        driver.find_element(By.NAME, "ProposalMenu").click()
+        self.transition()
+        driver.find_element(By.LINK_TEXT,
+            "Grant Record and Related Research Work of Investigator(s)"
+        ).click()
+        self.until_clickable(By.XPATH, add_proj_xpath)
+
+    def clear_records(self):
+        """Delete all saved records. Returns the number deleted."""
+        driver = self.driver
+
+        ### Clean all old entries ###
+        cleared_cnt = 0
+        cleared = False
+        while not cleared:
+            self.until_clickable(By.XPATH, add_proj_xpath)
+            buttons = driver.find_elements(By.XPATH, "//input[@type='button']")
+            button_value = buttons[0].get_attribute('value').strip()
+            if len(button_value) >= min_refno_len \
+                    and 'Objective' not in button_value \
+                    and 'Project' not in button_value:
+                self.transition()
+                buttons[0].click()
+                self.until_clickable(By.NAME, 'piName')
+                self.transition()
+                driver.find_element(By.NAME, 'del').click()
+                driver.switch_to.alert.accept()
+                cleared_cnt += 1
+            else:
+                buttons = driver.find_elements(By.XPATH,
+                                               "//input[@type='button']")
+                for button in buttons:
+                    button_value = button.get_attribute('value').strip()
+                    assert len(button_value) < min_refno_len \
+                           or 'Objective' in button_value \
+                           or 'Project' in button_value
+                cleared = True
+        clear_logger.info('All old entries cleaned to prepare for new input.')
+        return cleared_cnt
+
+    def clear_records_bulk(self):
+        """
+        Delete all saved records with a minimum of round-trips.
+
+        The records are listed once. Each one is then opened and deleted by
+        one script call each, without re-reading the record buttons, and an
+        empty list is verified with a single read at the end. Any record
+        left over, e.g. because the page asks for confirmation in another
+        way, is deleted by `clear_records`. Returns the number deleted.
+        """
+        driver = self.driver
+        records = self.record_buttons()
+        clear_logger.info('%d old entries to delete.', len(records))
+        for record in records:
+            # Each deletion reloads the list, so the next record is first
+            self.transition()
+            value = driver.execute_script(click_record_js, min_refno_len, 0)
+            if value is None:
+                break
+            self.until_clickable(By.NAME, 'piName')
+            self.transition()
+            driver.execute_script(delete_record_js)
+            self.until_clickable(By.XPATH, add_proj_xpath)
+            clear_logger.debug('Deleted %s', value)
+
+        remaining = self.record_buttons()
+        cleared_cnt = len(records) - len(remaining)
+        if remaining:
+            clear_logger.warning('%d entries left after bulk delete. '
+                                 'Deleting them one by one.', len(remaining))
+            cleared_cnt += self.clear_records()
         else:
-            inputdict["NHR"] = 0
-        inputdict["OBJ"] = str(row[1]["Project Objectives"])
+            clear_logger.info('All old entries cleaned to prepare for new '
+                              'input.')
+        return cleared_cnt
+
+    def fill_record(self, inputdict, verify=True):
+        """
+        Add one grant record through the form.
+
+        With `verify`, every field is read back and asserted right after it
+        is filled. Otherwise the read-backs are skipped and the caller is
+        expected to run `verify_records` once all records are saved.
+        """
+        driver = self.driver
 
         # Load the Form
-        wait.until(EC.element_to_be_clickable(
-            (By.XPATH, "//input[@value=' Add Project / Work " +
-                       "(GRF/ECS & non-GRF/non-ECS) ']")))
-        add_proj = driver.find_element(By.XPATH,
-            "//input[@value=' Add Project / Work " +
-            "(GRF/ECS & non-GRF/non-ECS) ']")
+        self.until_clickable(By.XPATH, add_proj_xpath)
+        add_proj = driver.find_element(By.XPATH, add_proj_xpath)
+        self.transition()
         add_proj.click()
-        wait.until(EC.element_to_be_clickable((By.NAME, "piName")))  # id same
+        self.until_clickable(By.NAME, "piName")  # id same
 
         # Name of Investigator(s) :
         npi_filled = False
@@ -314,11 +1151,14 @@ def fill_rgc():
             try:
                 input_pi_name = driver.find_element(By.NAME, "piName")
                 input_pi_name.send_keys(inputdict["NPI"])
-                assert input_pi_name.get_attribute("value") == inputdict["NPI"]
+                if verify:
+                    assert input_pi_name.get_attribute("value") == \
+                           inputdict["NPI"]
                 npi_filled = True
-                logger.info("Name of Investigator(s) filled.")
+                fill_logger.info("Name of Investigator(s) filled.",
+                                 extra={'field': 'piName'})
             except AssertionError:
-                logger.debug(
+                fill_logger.debug(
                     "WARNING: Wrong value (Name of Investigator(s)). Retrying")
                 input_pi_name.clear()
 
@@ -328,95 +1168,102 @@ def fill_rgc():
             "//select[@name='capacity']/option[@value='" + str(
                 inputdict['CAP']) + "']").click()
         # P/PC/C/Co-PI
-        logger.info("(Investigator) Capacity selected.")
+        fill_logger.info("(Investigator) Capacity selected.",
+                         extra={'field': 'capacity'})
 
         # Funding Sources
         # radio, name=fund_src_flag, id=(fund_src_flag_Y, fund_src_flag_N)
         driver.find_element(By.ID,
             "fund_src_flag_" + inputdict["FSF"]).click()  # radio button
         if inputdict['FSF'] == "N":
-            driver.find_element(By.NAME, "fund_src").send_keys(inputdict["FSR"])
-            assert driver.find_element(By.NAME, "fund_src")\
-                       .get_attribute("value") == inputdict["FSR"]
-        logger.info("Funding Sources filled.")
+            driver.find_element(By.NAME, "fund_src").send_keys(
+                inputdict["FSR"])
+            if verify:
+                assert driver.find_element(By.NAME, "fund_src")\
+                           .get_attribute("value") == inputdict["FSR"]
+        fill_logger.info("Funding Sources filled.",
+                         extra={'field': 'fund_src'})
 
         # Status
         driver.find_element(By.NAME, "proj_status").click()
         driver.find_element(By.XPATH,
             "//select[@name='proj_status']/option[@value='" + inputdict[
                 'STA'] + "']").click()  # id same
-        assert Select(driver.find_element(By.NAME,
-            "proj_status")).first_selected_option.get_attribute("value") == \
-               inputdict["STA"]
-        logger.info("Status filled.")
+        if verify:
+            assert Select(driver.find_element(By.NAME, "proj_status"))\
+                       .first_selected_option.get_attribute("value") == \
+                   inputdict["STA"]
+        fill_logger.info("Status filled.",
+                         extra={'field': 'proj_status'})
 
         # Project Reference No.(if any)
         driver.find_element(By.NAME, "ref_no").send_keys(
             inputdict["RNO"])  # text, no id
-        assert driver.find_element(By.NAME, "ref_no").get_attribute("value") == \
-               inputdict["RNO"]
-        logger.info("Project Reference No. filled.")
+        if verify:
+            assert driver.find_element(By.NAME, "ref_no")\
+                       .get_attribute("value") == inputdict["RNO"]
+        fill_logger.info("Project Reference No. filled.",
+                         extra={'field': 'ref_no'})
 
         # Project / Work Title
         driver.find_element(By.NAME, "proj_title").send_keys(
             inputdict["PTI"])  # text, no id
-        assert driver.find_element(By.NAME, "proj_title").get_attribute("value")\
-               == inputdict["PTI"]
-        logger.info("Project / Work Title filled.")
+        if verify:
+            assert driver.find_element(By.NAME, "proj_title")\
+                       .get_attribute("value") == inputdict["PTI"]
+        fill_logger.info("Project / Work Title filled.",
+                         extra={'field': 'proj_title'})
 
         # Funding Amount (HK$) (if not applicable, please input zero)
-        try:
-            inputdict["FAM"] = str(int(float(inputdict["FAM"])))
-        except ValueError:
-            inputdict["FAM"] = 0
-            assert inputdict["STA"] == 'U'
-            logger.warning("0 filled for unknown funding amount.")
         driver.find_element(By.NAME, "fund_amt").send_keys(inputdict["FAM"])
-        assert driver.find_element(By.NAME, "fund_amt").get_attribute("value") \
-               == inputdict["FAM"] or driver.find_element(By.NAME, "fund_amt")\
-                   .get_attribute("value") == '0'
-        logger.info("Funding Amount (HK$) filled.")
+        if verify:
+            assert driver.find_element(By.NAME, "fund_amt")\
+                       .get_attribute("value") == inputdict["FAM"] \
+                   or driver.find_element(By.NAME, "fund_amt")\
+                       .get_attribute("value") == '0'
+        fill_logger.info("Funding Amount (HK$) filled.",
+                         extra={'field': 'fund_amt'})
 
         # RGC / UGC Funding (radio button)
-        if inputdict["FSF"] == "Y":
-            assert inputdict["RGC"] == "Y"
         driver.find_element(By.ID, "ugcfunding_" + inputdict["RGC"]).click()
-        logger.info("UGC/RGC funding filled.")
+        fill_logger.info("UGC/RGC funding filled.",
+                         extra={'field': 'ugcfunding'})
 
         # Start Date
         driver.find_element(By.NAME, "s_day").click()
-        driver.find_element(By.XPATH, 
+        driver.find_element(By.XPATH,
             "//select[@name='s_day']/option[@value='" + inputdict[
                 'SDA'] + "']").click()
         driver.find_element(By.NAME, "s_month").click()
-        driver.find_element(By.XPATH, 
+        driver.find_element(By.XPATH,
             "//select[@name='s_month']/option[@value='" + inputdict[
                 'SMO'] + "']").click()
         driver.find_element(By.NAME, "s_year").click()
-        driver.find_element(By.XPATH, 
+        driver.find_element(By.XPATH,
             "//select[@name='s_year']/option[@value='" + inputdict[
                 'SYR'] + "']").click()
 
         # Estimated / Completion Date
         driver.find_element(By.NAME, "c_day").click()
-        driver.find_element(By.XPATH, 
+        driver.find_element(By.XPATH,
             "//select[@name='c_day']/option[@value=" + inputdict[
                 'CDA'] + "]").click()
         driver.find_element(By.NAME, "c_month").click()
-        driver.find_element(By.XPATH, 
+        driver.find_element(By.XPATH,
             "//select[@name='c_month']/option[@value=" + inputdict[
                 'CMO'] + "]").click()
         driver.find_element(By.NAME, "c_year").click()
         cyr_filled = False
         while not cyr_filled:
             try:
-                driver.find_element(By.XPATH, 
+                driver.find_element(By.XPATH,
                     "//select[@name='c_year']/option[@value=" + inputdict[
                         'CYR'] + "]").click()
                 cyr_filled = True
-                logger.info('Completion Year filled.')
+                fill_logger.info('Completion Year filled.',
+                                 extra={'field': 'c_year'})
             except ElementNotInteractableException:
-                logger.debug("WARNING: ElementNotInteractable " +
+                fill_logger.debug("WARNING: ElementNotInteractable " +
                              "(Completion Year). Retrying.")
 
         # Number of Hours Per Week Spent by the PI in Each On-going Project*
@@ -427,12 +1274,15 @@ def fill_rgc():
             while not nhr_filled:
                 try:
                     text_nhr.send_keys(inputdict["NHR"])  # text, d same
-                    assert text_nhr.get_attribute("value") == inputdict["NHR"]
+                    if verify:
+                        assert text_nhr.get_attribute("value") == \
+                               inputdict["NHR"]
                     nhr_filled = True
-                    logger.info("Number of Hours filled")
+                    fill_logger.info("Number of Hours filled",
+                                     extra={'field': 'workHourPer'})
                 except AssertionError:
                     text_nhr.clear()
-                    logger.debug(
+                    fill_logger.debug(
                         "WARNING: Wrong Number of Hours filled. Retrying.")
 
         # Project / Work Objective
@@ -444,40 +1294,959 @@ def fill_rgc():
         # radio, name=overlap, id=(overlap_NA, overlap_RE)
 
         # Save record
+        self.transition()
         driver.find_element(By.NAME, "add").click()
-        filled_cnt += 1
 
-    timestamp = datetime.datetime.now().strftime("%Y/%m/%d %H:%M:%S")
-    logger.info(timestamp)
+    def fill_planned(self, plan, values):
+        """
+        Add one record through a form compiled from a spec.
+
+        All fields are set and read back in one script call. Mismatched
+        fields are set once more before the record is rejected.
+        """
+        driver = self.driver
+        self.until_clickable(*plan.locators['open'])
+        self.transition()
+        driver.find_element(*plan.locators['open']).click()
+        self.until_clickable(*plan.locators['ready'])
+
+        ops = plan.ops(values)
+        result = driver.execute_script(plan.script, ops)
+        diff = plan.diff(values, result['values'])
+        if diff:
+            fill_logger.debug('WARNING: Wrong values %s. Retrying.', diff)
+            result = driver.execute_script(
+                plan.script, [op for op in ops if op[0] in diff])
+            diff = plan.diff(values, result['values'])
+            if diff:
+                raise AssertionError('Fields not filled as expected: ' +
+                                     json.dumps(diff, ensure_ascii=False))
+        for name in result['disabled']:
+            fill_logger.debug('%s disabled by the page. Skipped.', name,
+                              extra={'field': name})
+        fill_logger.info('%d fields filled and verified.', len(ops) -
+                         len(result['disabled']))
+
+        self.transition()
+        driver.find_element(*plan.locators['submit']).click()
+
+    def record_buttons(self):
+        """Return [button, value] of every saved record in list order."""
+        self.until_clickable(By.XPATH, add_proj_xpath)
+        return self.driver.execute_script(record_buttons_js, min_refno_len)
+
+    def read_saved_records(self):
+        """
+        Open each saved record in turn and read back all its values.
+
+        Each record costs two page loads: opening it and returning to the
+        list.
+        """
+        saved = []
+        for position in range(len(self.record_buttons())):
+            saved.append(self.read_saved_record(position))
+        verify_logger.info('%d saved records read back.', len(saved))
+        return saved
+
+    def read_saved_record(self, position):
+        """Open the saved record at `position` and read back its values."""
+        driver = self.driver
+        self.transition()
+        driver.execute_script(click_record_js, min_refno_len, position)
+        self.until_clickable(By.NAME, 'piName')
+        values = driver.execute_script(read_form_js)
+        self.return_to_record_list()
+        return values
+
+    def return_to_record_list(self):
+        """Go back from a record form to the grant record list."""
+        # The list may be the response to a form submission, which the
+        # browser history cannot return to without resubmitting. The menu is
+        # used where the form page shows it, otherwise the history.
+        if self.driver.find_elements(By.NAME, "ProposalMenu"):
+            self.open_record_list()
+            return
+        self.transition()
+        self.driver.back()
+        self.until_clickable(By.XPATH, add_proj_xpath)
+
+    def delete_record(self, position):
+        self.transition()
+        self.record_buttons()[position][0].click()
+        self.until_clickable(By.NAME, 'piName')
+        self.transition()
+        self.driver.find_element(By.NAME, 'del').click()
+        self.driver.switch_to.alert.accept()
+
+    def verify_records(self, inputdicts):
+        """
+        Verify all saved records against the input in bulk.
+
+        The saved records are read back once and paired with the input
+        records. Saved records that differ from their input are deleted and
+        re-submitted with inline verification, as are input records missing
+        online. Saved records matching no input are deleted. Returns the
+        structured diff of the first read-back.
+        """
+        saved = self.read_saved_records()
+        unpaired = list(range(len(saved)))
+        diff = []
+        resubmit = []
+
+        # Pair by reference number where it is unique on both sides, so that
+        # a badly saved record is not mistaken for a stray one
+        ref_nos = [d["RNO"] for d in inputdicts]
+        saved_ref_nos = [r.get(form_fields["RNO"], '') for r in saved]
+        pairs = {}
+        for index, ref_no in enumerate(ref_nos):
+            if ref_no and ref_nos.count(ref_no) == 1 and \
+                    saved_ref_nos.count(ref_no) == 1:
+                pairs[index] = saved_ref_nos.index(ref_no)
+                unpaired.remove(pairs[index])
+
+        for index, inputdict in enumerate(inputdicts):
+            expected = expected_form_values(inputdict)
+            if index in pairs:
+                fields = diff_form_values(expected, saved[pairs[index]])
+                if fields:
+                    diff.append({'record': index, 'ref_no': inputdict["RNO"],
+                                 'position': pairs[index], 'fields': fields})
+                    resubmit.append(index)
+                continue
+            best = None
+            for position in unpaired:
+                fields = diff_form_values(expected, saved[position])
+                if best is None or len(fields) < len(best[1]):
+                    best = (position, fields)
+            if best is None or len(best[1]) > len(expected) // 2:
+                diff.append({'record': index, 'ref_no': inputdict["RNO"],
+                             'position': None, 'fields': None})
+                resubmit.append(index)
+                continue
+            unpaired.remove(best[0])
+            if best[1]:
+                diff.append({'record': index, 'ref_no': inputdict["RNO"],
+                             'position': best[0], 'fields': best[1]})
+                resubmit.append(index)
+        # Every saved record was written by this run, so one that matches no
+        # input is a badly saved copy and must go before re-submitting
+        for position in unpaired:
+            verify_logger.warning("WARNING: Saved record not in input: %s",
+                                  saved[position].get(form_fields["RNO"]))
+
+        if not diff and not unpaired:
+            verify_logger.info('All %d saved records verified.',
+                               len(inputdicts))
+            return diff
+        verify_logger.warning('Verification diff: %s',
+                              json.dumps(diff, ensure_ascii=False))
+
+        # Delete from the bottom so that earlier positions remain valid
+        for position in sorted([d['position'] for d in diff
+                                if d['position'] is not None] + unpaired,
+                               reverse=True):
+            self.delete_record(position)
+        for index in resubmit:
+            self.fill_record(inputdicts[index], verify=True)
+        verify_logger.info('%d records re-submitted.', len(resubmit))
+        return diff
+
+    def locate_records(self, expected, confirm=False):
+        """
+        Positions of the saved records showing the `expected` form values,
+        or None if not all of them are found.
+
+        A record whose reference number shows on exactly one record button is
+        located from the record list alone, unless `confirm` is set, when
+        that record is also read back and compared. This is needed where the
+        record with the same reference number may be another input record,
+        e.g. a renewed grant. The others are located by reading back all
+        saved records once.
+        """
+        values = [value for _, value in self.record_buttons()]
+        positions = []
+        unresolved = []
+        for record in expected:
+            ref_no = record.get(form_fields["RNO"], '')
+            if ref_no and values.count(ref_no) == 1 and \
+                    values.index(ref_no) not in positions:
+                position = values.index(ref_no)
+                # No other saved record has this reference number, so the
+                # record is not saved if this one differs
+                if confirm and diff_form_values(
+                        record, self.read_saved_record(position)):
+                    return None
+                positions.append(position)
+            else:
+                unresolved.append(record)
+        if unresolved:
+            saved = self.read_saved_records()
+            for record in unresolved:
+                for position, actual in enumerate(saved):
+                    if position not in positions and \
+                            not diff_form_values(record, actual):
+                        positions.append(position)
+                        break
+                else:
+                    return None
+        return positions
+
+    def check_duplicates(self):
+        ### Check and warn for duplicate Ref No ###
+        """
+        Attention:
+        Renewable grants may have same Ref No and different Project Title
+        & Time Period.
+        """
+
+        entered = []
+        dups = []
+
+        buttons = self.driver.find_elements(By.XPATH,
+                                            "//input[@type='button']")
+
+        for button in buttons:
+            button_value = button.get_attribute("value").strip()
+            if len(
+                    button_value) >= min_refno_len \
+                    and "Objective" not in button_value \
+                    and "Project" not in button_value:
+                if button_value in entered:
+                    dups.append(button_value)
+                    verify_logger.warning(
+                        "WARNING: Potential duplicated entry: " + button_value)
+                entered.append(button.get_attribute("value"))
+
+        verify_logger.info("Potential duplicated entries: " + ', '.join(dups))
+
+
+### Browser worker ###
+
+
+class BrowserWorker:
+    """
+    Owns the driver of a run and its RGCSession on the grant record page.
+
+    The driver is recycled, i.e. quit and replaced by a fresh one that logs
+    in and reopens the grant record page, after `recycle_after` records,
+    when the driver and browser processes use more than `recycle_rss` MB,
+    or when the driver no longer responds. 0 disables either limit.
+    `start_driver` is called without arguments to get each new driver, and
+    `session_kwargs` are passed on to every RGCSession.
+    """
+
+    def __init__(self, start_driver, user_id, pw, recycle_after=0,
+                 recycle_rss=0, profiler=None, **session_kwargs):
+        self.start_driver = start_driver
+        self.user_id = user_id
+        self.pw = pw
+        self.recycle_after = recycle_after
+        self.recycle_rss = recycle_rss
+        self.profiler = profiler
+        self.session_kwargs = session_kwargs
+        self.driver = None
+        self.session = None
+        self.records = 0    # records handled by the current driver
+        self.recycled = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.quit()
+
+    def start(self):
+        """Start a driver, log in and open the grant record page."""
+        self.driver = self.start_driver()
+        self.records = 0
+        if self.profiler:
+            self.profiler.install(self.driver)
+        self.driver.delete_all_cookies()
+        self.session = RGCSession(self.driver, **self.session_kwargs)
+        self.session.login(self.user_id, self.pw)
+        self.session.open_grant_records()
+        return self.session
+
+    def quit(self):
+        """Quit the browser and make sure its driver process is stopped."""
+        driver, self.driver, self.session = self.driver, None, None
+        if driver is None:
+            return
+        try:
+            driver.quit()
+        except Exception as e:
+            worker_logger.warning('Driver quit failed: %s', e)
+        service = getattr(driver, 'service', None)
+        process = getattr(service, 'process', None)
+        if process is not None and process.poll() is None:
+            worker_logger.warning('Driver still running after quit. '
+                                  'Stopping it.')
+            try:
+                service.stop()
+            except Exception as e:
+                worker_logger.warning('Driver stop failed: %s', e)
+
+    def healthy(self):
+        """Whether the driver and the browser still respond."""
+        process = getattr(getattr(self.driver, 'service', None), 'process',
+                          None)
+        if process is not None and process.poll() is not None:
+            return False
+        try:
+            self.driver.execute_script('return document.readyState')
+            return True
+        except WebDriverException as e:
+            worker_logger.warning('Driver unhealthy: %s', e.msg)
+            return False
+
+    def rss(self):
+        """Resident memory in MB of the driver and its browser processes."""
+        try:
+            return driver_rss(self.driver) / 2 ** 20
+        except (AttributeError, OSError):
+            return 0
+
+    def recycle(self, reason):
+        """Replace the driver by a fresh one on the grant record page."""
+        start = time.monotonic()
+        worker_logger.info('Recycling the browser after %d records: %s',
+                           self.records, reason)
+        self.quit()
+        self.start()
+        self.recycled += 1
+        elapsed = time.monotonic() - start
+        worker_logger.info('Browser recycled in %.1f s', elapsed,
+                           extra={'phase': 'recycle',
+                                  'elapsed': round(elapsed, 3)})
+
+    def recycle_due(self):
+        """Reason to recycle the driver before the next record, if any."""
+        if self.recycle_after and self.records >= self.recycle_after:
+            return '%d records' % self.records
+        if self.recycle_rss and self.records:
+            rss = self.rss()
+            if rss > self.recycle_rss:
+                return '%.0f MB resident' % rss
+        return None
+
+    def fill(self, fill_record, expected):
+        """
+        Run `fill_record(session)`, recycling the driver first if due, and
+        once more if it stops responding while filling, unless the record
+        showing the `expected` form values was saved before it stopped.
+        """
+        reason = self.recycle_due()
+        if reason:
+            self.recycle(reason)
+        try:
+            fill_record(self.session)
+        except WebDriverException:
+            if self.healthy():
+                raise
+            self.recycle('driver unhealthy')
+            if self.session.locate_records([expected],
+                                           confirm=True) is not None:
+                worker_logger.info('Record saved before the driver stopped. '
+                                   'Not filling it again.')
+            else:
+                fill_record(self.session)
+        self.records += 1
+
+    def fill_record(self, inputdict, verify=True):
+        self.fill(lambda session: session.fill_record(inputdict,
+                                                      verify=verify),
+                  expected_form_values(inputdict))
+
+    def fill_planned(self, plan, values):
+        self.fill(lambda session: session.fill_planned(plan, values), values)
+
+
+def exit_on_sigterm():
+    """
+    Turn SIGTERM into SystemExit, so that the `finally` clauses quitting the
+    browsers also run when a daemon or batch run is stopped.
+    """
+    def handler(signum, frame):
+        raise SystemExit(128 + signum)
+    signal.signal(signal.SIGTERM, handler)
+
+
+### Watch mode ###
+
+
+def watch_signature(path):
+    """Modification time and size of an input file or grant store."""
+    if os.path.isdir(path):
+        path = os.path.join(path, 'index.json')
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class InputWatcher:
+    """
+    Waits for changes of an input file or grant store.
+
+    Filesystem notifications are used if `watchdog` is installed, otherwise
+    the modification time is polled every `interval` seconds. A change is
+    reported once the file has stayed the same for `settle` seconds, as
+    editors and Excel save in several steps.
+    """
+
+    def __init__(self, path, interval=1.0, settle=0.5):
+        self.path = os.path.abspath(path)
+        self.interval = interval
+        self.settle = settle
+        self.signature = watch_signature(self.path)
+        self.notified = threading.Event()
+        self.observer = None
+        try:
+            from watchdog.observers import Observer
+            from watchdog.events import FileSystemEventHandler
+        except ImportError:
+            return
+
+        watcher = self
+
+        class Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                paths = [event.src_path, getattr(event, 'dest_path', '')]
+                if any(os.fsdecode(p).startswith(watcher.path) for p in paths):
+                    watcher.notified.set()
+
+        self.observer = Observer()
+        self.observer.schedule(Handler(), os.path.dirname(self.path),
+                               recursive=os.path.isdir(self.path))
+        self.observer.start()
+
+    def wait(self):
+        """Block until the input has changed and settled."""
+        while True:
+            if self.observer:
+                # Notifications may be missed, e.g. on network drives, so
+                # check the file every minute anyway
+                self.notified.wait(60)
+                self.notified.clear()
+            else:
+                time.sleep(self.interval)
+            signature = watch_signature(self.path)
+            if signature is None or signature == self.signature:
+                continue
+            while True:
+                time.sleep(self.settle)
+                current = watch_signature(self.path)
+                if current == signature:
+                    break
+                signature = current
+            if signature is None:
+                continue
+            self.signature = signature
+            return
+
+    def stop(self):
+        if self.observer:
+            self.observer.stop()
+            self.observer.join()
+
+
+def record_key(values):
+    """Hashable key of the form values of a record."""
+    return tuple(sorted((name, str(value)) for name, value in values.items()))
+
+
+def watch_entries(records, pi_name, plan=None):
+    """[key, record to fill, expected form values] of each input record."""
+    entries = []
+    for row in records:
+        if plan:
+            record = expected = plan.values(row, {'pi_name': pi_name})
+        else:
+            record = build_inputdict(row, pi_name)
+            expected = expected_form_values(record)
+        entries.append([record_key(expected), record, expected])
+    return entries
+
 
-    logger.info("Record entry complete. A total of " + str(filled_cnt) +
-        " entries filled.")
+def fill_entry(worker, entry, plan=None):
+    """Fill the record of a watch entry through the worker."""
+    if plan:
+        worker.fill_planned(plan, entry[1])
+    else:
+        worker.fill_record(entry[1], verify=True)
 
-    ### Check and warn for duplicate Ref No ###
+
+def push_changes(worker, current, new, plan=None):
+    """
+    Bring the saved records from the `current` to the `new` input entries.
+
+    Only records that changed are deleted and added. If the records to
+    delete cannot all be located online, all records are cleared and
+    filled again. Returns the number of records deleted and added.
+    """
+    removed = collections.Counter(key for key, _, _ in current) - \
+        collections.Counter(key for key, _, _ in new)
+    added = collections.Counter(key for key, _, _ in new) - \
+        collections.Counter(key for key, _, _ in current)
+
+    def pick(entries, counts):
+        counts = collections.Counter(counts)
+        picked = []
+        for entry in entries:
+            if counts[entry[0]] > 0:
+                counts[entry[0]] -= 1
+                picked.append(entry)
+        return picked
+
+    to_delete = pick(current, removed)
+    to_add = pick(new, added)
+    if not to_delete and not to_add:
+        logger.info('No record changed.')
+        return 0, 0
+
+    positions = worker.session.locate_records([e[2] for e in to_delete]) \
+        if to_delete else []
+    if positions is None:
+        logger.warning('Changed records not found online. Filling all %d '
+                       'records again.', len(new))
+        deleted = worker.session.clear_records_bulk()
+        to_add = new
+    else:
+        # Delete from the bottom so that earlier positions remain valid
+        for position in sorted(positions, reverse=True):
+            worker.session.delete_record(position)
+        deleted = len(positions)
+    for entry in to_add:
+        fill_entry(worker, entry, plan)
+    logger.info('%d records deleted and %d added online.', deleted,
+                len(to_add))
+    return deleted, len(to_add)
+
+
+def watch_input(worker, args, records, plan=None):
+    """
+    Keep the session on the grant record page and push every change of the
+    input into it, until interrupted.
+    """
+    current = watch_entries(records, args.pi_name, plan)
+    watcher = InputWatcher(args.input)
+    logger.info('Watching %s for changes (%s). Press Ctrl-C to stop.',
+                args.input, 'notifications' if watcher.observer
+                else 'polling')
+    try:
+        while True:
+            watcher.wait()
+            logger.info('%s changed.', args.input)
+            try:
+                new = watch_entries(load_records(args.input, args.pi_name,
+                                                 args.input_format),
+                                    args.pi_name, plan)
+            except Exception as e:
+                logger.warning('Input not loaded, waiting for the next '
+                               'change: %r', e)
+                continue
+            try:
+                with run_phase('push') as phase:
+                    deleted, added = push_changes(worker, current, new, plan)
+                    phase['records'] = deleted + added
+            except WebDriverException as e:
+                # The saved records are unknown after a partial push, so
+                # they are all cleared and filled again on a fresh browser
+                logger.warning('Push failed. Filling all %d records again: '
+                               '%s', len(new), e.msg)
+                worker.recycle('push failed')
+                with run_phase('resync') as phase:
+                    deleted = worker.session.clear_records_bulk()
+                    for entry in new:
+                        fill_entry(worker, entry, plan)
+                    phase['records'] = deleted + len(new)
+            current = new
+    except KeyboardInterrupt:
+        logger.info('Watch mode stopped.')
+    finally:
+        watcher.stop()
+
+
+### Profiling ###
+selenium_dir = os.path.dirname(webdriver.__file__)
+
+
+class CommandProfiler:
+    """
+    Count and time every WebDriver command of a driver.
+
+    Commands are accounted by the Selenium API called from this script
+    (e.g. find_element, send_keys, get_attribute, click, execute_script),
+    by wire protocol command, by call site and by run phase. Optionally,
+    cProfile runs over the engine between `start` and `stop`.
+    """
+
+    def __init__(self, python_profile=False):
+        self.api = {}         # API -> [count, seconds]
+        self.wire = {}        # wire command -> [count, seconds]
+        self.call_sites = {}  # (call site, API) -> [count, seconds]
+        self.phases = {}      # phase -> {'commands', 'command_seconds', ...}
+        self.phase = None
+        self.python_profile = cProfile.Profile() if python_profile else None
+
+    def install(self, driver):
+        """Wrap the command executor of `driver` to account its commands."""
+        executor = driver.command_executor
+        execute = executor.execute
+
+        def profiled_execute(command, params):
+            start = time.perf_counter()
+            try:
+                return execute(command, params)
+            finally:
+                self._account(command, time.perf_counter() - start)
+
+        executor.execute = profiled_execute
+
+    def _account(self, command, seconds):
+        # The outermost Selenium frame is the API called from this script,
+        # and the frame above it is the call site
+        api = command
+        frame = sys._getframe(2)
+        while frame is not None and \
+                frame.f_code.co_filename.startswith(selenium_dir):
+            api = frame.f_code.co_name
+            frame = frame.f_back
+        if frame is not None:
+            site = frame.f_code.co_name + ' (' + os.path.basename(
+                frame.f_code.co_filename) + ':' + str(frame.f_lineno) + ')'
+        else:
+            site = '?'
+        for table, key in ((self.api, api), (self.wire, command),
+                           (self.call_sites, (site, api))):
+            entry = table.setdefault(key, [0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+        if self.phase is not None:
+            phase = self.phases[self.phase]
+            phase['commands'] += 1
+            phase['command_seconds'] += seconds
+
+    def start(self):
+        if self.python_profile:
+            self.python_profile.enable()
+
+    def stop(self):
+        if self.python_profile:
+            self.python_profile.disable()
+
+    def begin_phase(self, phase):
+        self.phase = phase
+        self.phases.setdefault(phase, {'commands': 0, 'command_seconds': 0.0,
+                                       'seconds': 0.0, 'records': None})
+
+    def end_phase(self, elapsed, records=None):
+        self.phases[self.phase]['seconds'] += elapsed
+        if records is not None:
+            self.phases[self.phase]['records'] = records
+        self.phase = None
+
+    def report(self, top=20):
+        """Return the profile as a JSON-serializable dict."""
+        def table(entries, name):
+            return [{name: key, 'count': count, 'seconds': round(seconds, 4),
+                     'mean_ms': round(seconds / count * 1000, 2)}
+                    for key, (count, seconds) in sorted(
+                        entries.items(), key=lambda e: -e[1][1])]
+
+        fill = self.phases.get('fill', {})
+        report = {
+            'commands': sum(count for count, _ in self.api.values()),
+            'command_seconds': round(sum(s for _, s in self.api.values()), 4),
+            'records': fill.get('records'),
+            'commands_per_record': round(fill['commands'] / fill['records'],
+                                         1) if fill.get('records') else None,
+            'phases': {name: dict(phase,
+                                  seconds=round(phase['seconds'], 3),
+                                  command_seconds=round(
+                                      phase['command_seconds'], 3))
+                       for name, phase in self.phases.items()},
+            'command_types': table(self.api, 'command'),
+            'wire_commands': table(self.wire, 'command'),
+            'call_sites': [dict(entry, site=entry['command'][0],
+                                command=entry['command'][1])
+                           for entry in table(self.call_sites,
+                                              'command')[:top]],
+        }
+        if self.python_profile:
+            stream = io.StringIO()
+            pstats.Stats(self.python_profile, stream=stream)\
+                .sort_stats('cumulative').print_stats(top)
+            report['python'] = stream.getvalue().splitlines()
+        return report
+
+    def write_report(self, report_path):
+        report = self.report()
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=1, ensure_ascii=False)
+        if self.python_profile:
+            self.python_profile.dump_stats(
+                os.path.splitext(report_path)[0] + '.prof')
+        logger.info('Profile: %d WebDriver commands (%.1f s), %s per record',
+                    report['commands'], report['command_seconds'],
+                    report['commands_per_record'])
+        for entry in report['command_types'][:5]:
+            logger.info('Profile: %-22s %5d commands %8.2f s',
+                        entry['command'], entry['count'], entry['seconds'])
+        logger.info('Profile report written to %s', report_path)
+        return report
+
+
+@contextlib.contextmanager
+def run_phase(phase, profiler=None):
+    """
+    Time a run phase and log its wall time as a structured record.
+
+    The caller may store the number of records handled in the yielded dict.
+    """
+    info = {}
+    start = time.monotonic()
+    if profiler:
+        profiler.begin_phase(phase)
+    yield info
+    elapsed = time.monotonic() - start
+    if profiler:
+        profiler.end_phase(elapsed, info.get('records'))
+    extra = {'phase': phase, 'elapsed': round(elapsed, 3)}
+    if 'records' in info:
+        extra['records'] = info['records']
+    logger.info('Phase %s finished in %.1f s', phase, elapsed, extra=extra)
+
+
+### Set input arguments ###
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Parse user ID, password ' +
+                                                 'and grant record Excel file '+
+                                                 'to the GRF application for '
+                                                 'auto form filling.')
+    parser.add_argument('-u', '--user_id', metavar='USER_ID', type=str,
+                        required=True, help='User ID')
+    parser.add_argument('-p', '--pw', metavar='PASSWD', type=str,
+                        required=True, help='Password')
+    parser.add_argument('-i', '--input', metavar='EXCEL_FILE_PATH', type=str,
+                        required=True,
+                        help='Input Excel, CSV, JSON-lines or Parquet file, '
+                             'or a grant store directory built by '
+                             'auto_grant_rec_store.py')
+    parser.add_argument('--input_format',
+                        choices=['auto', 'store'] + list(input_readers),
+                        default='auto',
+                        help='Input format (default: guessed from the '
+                             'extension)')
+    parser.add_argument('-n', '--pi_name', metavar='PI_NAME', type=str,
+                        required=True,
+                        help='PI name. Add double quotes, e.g. "Chan, Tai-man"')
+    parser.add_argument('-c', '--chromedriver_path', '--driver_path',
+                        metavar='CHROME_DRIVER_PATH',
+                        type=str, default=None,
+                        help='path to chromedriver, or to the driver of the '
+                             'browser chosen with --browser')
+    parser.add_argument('-b', '--browser', choices=list(backends),
+                        default='chrome', help='Browser to fill the form with')
+    parser.add_argument('--skip_driver_check', action='store_true',
+                        help='Do not check that the driver version fits the '
+                             'browser before starting')
+    parser.add_argument('--login_url', metavar='URL', type=str,
+                        default=login_url,
+                        help='Login page of the online system, e.g. of a '
+                             'local stand-in server for testing')
+    parser.add_argument('-l', '--log_path', metavar='LOG_FILE_PATH', type=str,
+                        default=datetime.datetime.now().strftime(
+                                '%Y%m%d-%H%M%S') + '-rgc-grantrec.log',
+                        help='path to run log')
+    parser.add_argument('--clear', choices=['single', 'bulk'],
+                        default='single',
+                        help='Delete the old records one page cycle at a time '
+                             '(single), or list them once and delete them by '
+                             'script calls (bulk)')
+    parser.add_argument('--verify', choices=['inline', 'deferred'],
+                        default='inline',
+                        help='Read back each field right after filling it '
+                             '(inline), or read back all saved records in '
+                             'bulk after filling and re-submit mismatches '
+                             '(deferred)')
+    parser.add_argument('--readiness', choices=['poll', 'observer'],
+                        default='poll',
+                        help='Wait for page transitions by polling the driver '
+                             '(poll), or by in-page DOM observers that '
+                             'resolve as soon as the page is usable '
+                             '(observer)')
+    parser.add_argument('--log_format', choices=['json', 'text'],
+                        default='json',
+                        help='Write the run log as JSON lines with job, PI, '
+                             'record and field context (json), or as plain '
+                             'text lines (text)')
+    parser.add_argument('--log_level', metavar='COMPONENT=LEVEL',
+                        type=log_level_arg, action='append', default=[],
+                        help='Set the log level of one component (' +
+                             ', '.join(log_components) + ' or any logger '
+                             'name, e.g. selenium). Repeat for several')
+    parser.add_argument('--spec', metavar='SPEC_PATH', type=str,
+                        help='Fill with a declarative form spec, e.g. '
+                             'grant_record_spec.json, instead of the '
+                             'built-in field logic')
+    parser.add_argument('--watch', action='store_true',
+                        help='After filling, keep the browser open and push '
+                             'every change of the input file until Ctrl-C')
+    parser.add_argument('--plan', dest='run_plan', metavar='PLAN_PATH',
+                        type=str,
+                        help='Log the wall time of this run against its '
+                             'prediction in a plan from auto_grant_rec_plan.py')
+    parser.add_argument('--recycle_after', metavar='RECORDS', type=int,
+                        default=0,
+                        help='Restart the browser after this many records '
+                             '(default: never)')
+    parser.add_argument('--recycle_rss', metavar='MB', type=int, default=0,
+                        help='Restart the browser when it uses more memory '
+                             'than this (default: no limit)')
+    parser.add_argument('--profile', metavar='REPORT_PATH', nargs='?',
+                        const='',
+                        help='Count and time every WebDriver command and '
+                             'write a JSON report (default: next to the log)')
+    parser.add_argument('--profile_python', action='store_true',
+                        help='With --profile, also run cProfile over the '
+                             'engine and add its hot spots to the report')
+    parser.add_argument('--verbose', nargs='?', type=int, const=1, default=0,
+                        help='Add this argument to log debug messages')
+    parser.add_argument('--version', '-v', action='version',
+                        version='%(prog)s ' + __version__)
+    parser.add_argument('--headless', nargs='?', const=True,
+                        help='Add this argument to skip showing the browser')
+    return parser
+
+
+def run(args, throttle=None):
     """
-    Attention:
-    Renewable grants may have same Ref No and different Project Title 
-    & Time Period.
+    Run one filler job with the parsed command-line `args`.
+
+    Logging is expected to be set up by the caller. `throttle` is passed on
+    to the RGCSession. Returns the number of records cleared and filled, and
+    the number of times the browser was recycled.
     """
+    run_start = time.monotonic()
+
+    ### Check browser and driver ###
+    backend = backends[args.browser]
+    driver_path = args.chromedriver_path
+    if not args.skip_driver_check:
+        driver_path = check_driver(backend, driver_path)['driver'] or \
+            driver_path
+
+    ### Prepare data ###
+    records = load_records(args.input, args.pi_name, args.input_format)
+    logger.info('%d records loaded from %s', len(records), args.input)
+    plan = None
+    if args.spec:
+        import auto_grant_rec_spec
+        plan = auto_grant_rec_spec.compile_spec(args.spec)
+        logger.info('Form spec %s compiled: %d fields', args.spec,
+                    len(plan.fields))
+
+    ### Prepare browser worker ###
+    profiler = None
+    if args.profile is not None:
+        profiler = CommandProfiler(args.profile_python)
+        profiler.start()
+    worker = BrowserWorker(
+        lambda: backend.start(driver_path, args.headless),
+        args.user_id, args.pw, recycle_after=args.recycle_after,
+        recycle_rss=args.recycle_rss, profiler=profiler,
+        readiness=args.readiness, throttle=throttle,
+        login_url=args.login_url)
+
+    with worker:
+        with run_phase('login', profiler):
+            worker.start()
+
+        with run_phase('clear', profiler) as phase:
+            if args.clear == 'bulk':
+                cleared_cnt = worker.session.clear_records_bulk()
+            else:
+                cleared_cnt = worker.session.clear_records()
+            phase['records'] = cleared_cnt
+
+        ### Input record ###
+        verify_inline = args.verify == 'inline'
+        inputdicts = []
+        filled_cnt = 0
 
-    entered = []
-    dups = []
+        with run_phase('fill', profiler) as phase:
+            for row in records:
+                set_log_context(record=filled_cnt)
+                logger.info('Filling record %d of %d', filled_cnt + 1,
+                            len(records))
+                start = time.monotonic()
+                if plan:
+                    values = plan.values(row, {'pi_name': args.pi_name})
+                    worker.fill_planned(plan, values)
+                else:
+                    inputdict = build_inputdict(row, args.pi_name)
+                    worker.fill_record(inputdict, verify=verify_inline)
+                    inputdicts.append(inputdict)
+                    values = expected_form_values(inputdict)
+                elapsed = time.monotonic() - start
+                logger.info('Record filled in %.1f s', elapsed,
+                            extra={'phase': 'record',
+                                   'elapsed': round(elapsed, 3),
+                                   'chars': record_chars(values)})
+                filled_cnt += 1
+            set_log_context(record=None)
+            phase['records'] = filled_cnt
 
-    buttons = driver.find_elements(By.XPATH, "//input[@type='button']")
+        logger.info("Record entry complete. A total of %d entries filled.",
+                    filled_cnt)
+
+        # Fill plans read back every record in the same script call
+        if not verify_inline and not plan:
+            with run_phase('verify', profiler) as phase:
+                worker.session.verify_records(inputdicts)
+                phase['records'] = filled_cnt
+
+        with run_phase('check', profiler):
+            worker.session.check_duplicates()
+
+        if args.run_plan:
+            import auto_grant_rec_plan
+            auto_grant_rec_plan.report_actual(
+                args.run_plan, args.input, args.pi_name,
+                time.monotonic() - run_start, filled_cnt)
+
+        if args.watch:
+            watch_input(worker, args, records, plan)
+
+    if profiler:
+        profiler.stop()
+        profiler.write_report(args.profile or
+                              os.path.splitext(args.log_path)[0] +
+                              '-profile.json')
+    return {'cleared': cleared_cnt, 'filled': filled_cnt,
+            'recycled': worker.recycled}
+
+
+def fill_rgc(argv=None):
+    args = build_parser().parse_args(argv)
+
+    ### Initialize logger ###
+    setup_logging(args.log_path, args.verbose, args.log_format,
+                  args.log_level)
+    set_log_context(pi=args.pi_name)
+
+    logger.debug(args)
 
-    for button in buttons:
-        button_value = button.get_attribute("value").strip()
-        if len(
-                button_value) >= min_refno_len \
-                and "Objective" not in button_value \
-                and "Project" not in button_value:
-            if button_value in entered:
-                dups.append(button_value)
-                logger.warning(
-                    "WARNING: Potential duplicated entry: " + button_value)
-            entered.append(button.get_attribute("value"))
+    exit_on_sigterm()
+    try:
+        run(args)
+    except DriverMismatchError as e:
+        sys.exit(str(e))
 
-    logger.info("Potential duplicated entries: " + ', '.join(dups))
 
 if __name__ == '__main__':
     fill_rgc()
@@ -0,0 +1,387 @@
+"""
+RGC application grant record auto-filler (batch job queue)
+==
+
+Queues grant record filling jobs for many PIs in a local SQLite file and
+runs them unattended with several browser workers. All workers share one
+token bucket that limits the rate of page transitions sent to the RGC
+server, which times out when too many sessions hit it at once. Failed jobs
+are retried automatically after an exponential back-off with jitter.
+
+## Dependencies
+Same as `auto_grant_rec.py`.
+
+## Usage
+- Queue one job per PI. Passwords are never stored in the queue: each job
+  names the environment variable holding its password. Options after `--`
+  are passed on to `auto_grant_rec.py`:
+  `python3 auto_grant_rec_batch.py add -u USER_ID --pw_env CHAN_PW
+   -n "CHAN, Tai-man" -i chan.xlsx -- -c /path/to/chromedriver --headless`
+- Run the queue with 3 browsers and at most 2 page transitions per second:
+  `python3 auto_grant_rec_batch.py run --workers 3 --rate 2`
+- Show the state of all jobs:
+  `python3 auto_grant_rec_batch.py status`
+- Queue failed jobs again:
+  `python3 auto_grant_rec_batch.py retry`
+
+## Remarks
+- Use `--queue` to keep separate queue files, e.g. one per deadline.
+- Only one runner should work on a queue file at a time. Jobs left running
+  by an interrupted runner are queued again when the next runner starts.
+"""
+
+__author__ = 'Claire Chung'
+__version__ = '1.3'
+__license__ = "MIT License"
+
+import argparse
+import contextlib
+import datetime
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+
+import auto_grant_rec
+
+logger = logging.getLogger('auto_grant_rec.batch')
+
+schema = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    pw_env TEXT NOT NULL,
+    pi_name TEXT NOT NULL,
+    input TEXT NOT NULL,
+    options TEXT NOT NULL DEFAULT '[]',
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 3,
+    next_run REAL NOT NULL DEFAULT 0,
+    last_error TEXT,
+    result TEXT,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, next_run);
+"""
+
+
+class JobQueue:
+    """
+    Durable queue of filler jobs in a SQLite file.
+
+    Job status goes from 'queued' to 'running' and then to 'done', back to
+    'queued' for a retry, or to 'failed' once `max_attempts` are used up.
+    Each call opens its own connection, so that one queue can be shared by
+    several worker threads.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with self._connect() as conn:
+            conn.executescript(schema)
+
+    @contextlib.contextmanager
+    def _connect(self, autocommit=False):
+        conn = sqlite3.connect(self.path, timeout=30,
+                               isolation_level=None if autocommit else '')
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def add(self, user_id, pw_env, pi_name, input_path, options=(),
+            max_attempts=3):
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "INSERT INTO jobs (user_id, pw_env, pi_name, input, options, "
+                "max_attempts, created) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (user_id, pw_env, pi_name, os.path.abspath(input_path),
+                 json.dumps(list(options)), max_attempts, time.time()))
+            return cursor.lastrowid
+
+    def claim(self):
+        """Atomically mark the next due job as running and return it."""
+        with self._connect(autocommit=True) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            job = conn.execute(
+                "SELECT * FROM jobs WHERE status = 'queued' AND next_run <= ? "
+                "ORDER BY next_run, id LIMIT 1", (time.time(),)).fetchone()
+            if job is not None:
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', attempts = "
+                    "attempts + 1, started = ?, finished = NULL WHERE id = ?",
+                    (time.time(), job['id']))
+            conn.execute("COMMIT")
+        return job
+
+    def complete(self, job_id, result):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'done', result = ?, last_error = "
+                "NULL, finished = ? WHERE id = ?",
+                (json.dumps(result), time.time(), job_id))
+
+    def fail(self, job_id, error, retry_delay):
+        """Queue the job again after `retry_delay` s unless out of attempts."""
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = CASE WHEN attempts < max_attempts "
+                "THEN 'queued' ELSE 'failed' END, next_run = ?, "
+                "last_error = ?, finished = ? WHERE id = ?",
+                (time.time() + retry_delay, error, time.time(), job_id))
+
+    def requeue(self, statuses=('failed',)):
+        """Queue jobs of the given statuses again with fresh attempts."""
+        marks = ', '.join('?' * len(statuses))
+        with self._connect() as conn:
+            return conn.execute(
+                "UPDATE jobs SET status = 'queued', attempts = 0, "
+                "next_run = 0 WHERE status IN (" + marks + ")",
+                tuple(statuses)).rowcount
+
+    def next_wait(self):
+        """
+        Seconds until the next queued job is due, 0 if jobs are still
+        running and may be queued again, or None if the queue is drained.
+        """
+        with self._connect() as conn:
+            next_run = conn.execute(
+                "SELECT MIN(next_run) FROM jobs WHERE status = 'queued'"
+            ).fetchone()[0]
+            if next_run is not None:
+                return max(0.0, next_run - time.time())
+            running = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = 'running'"
+            ).fetchone()[0]
+        return 0.0 if running else None
+
+    def jobs(self):
+        with self._connect() as conn:
+            return conn.execute("SELECT * FROM jobs ORDER BY id").fetchall()
+
+    def counts(self):
+        with self._connect() as conn:
+            return dict(conn.execute(
+                "SELECT status, COUNT(*) FROM jobs GROUP BY status"
+            ).fetchall())
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket allowing `rate` acquisitions per second on
+    average and bursts of up to `burst`.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available and take it."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens +
+                                  (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def retry_delay(attempts, base=30, cap=900):
+    """Exponential back-off in seconds, jittered by +/-50 %."""
+    return random.uniform(0.5, 1.5) * min(cap, base * 2 ** (attempts - 1))
+
+
+def parse_job_args(user_id, pw, pi_name, input_path, options):
+    argv = ['-u', user_id, '-p', pw, '-n', pi_name, '-i', input_path] + \
+        list(options)
+    return auto_grant_rec.build_parser().parse_args(argv)
+
+
+def job_args(job):
+    """Build the filler command-line arguments of a queued job."""
+    pw = os.environ.get(job['pw_env'])
+    if pw is None:
+        raise KeyError("Password environment variable " + job['pw_env'] +
+                       " is not set")
+    return parse_job_args(job['user_id'], pw, job['pi_name'], job['input'],
+                          json.loads(job['options']))
+
+
+def run_job(jobs, job, bucket, retry_base):
+    auto_grant_rec.set_log_context(job=job['id'], pi=job['pi_name'],
+                                   record=None)
+    logger.info('Job %d started (attempt %d of %d)', job['id'],
+                job['attempts'] + 1, job['max_attempts'])
+    start = time.monotonic()
+    try:
+        result = auto_grant_rec.run(job_args(job), throttle=bucket.acquire)
+    except (Exception, SystemExit) as e:
+        # SystemExit comes from argparse rejecting the stored options
+        delay = retry_delay(job['attempts'] + 1, retry_base)
+        jobs.fail(job['id'], repr(e), delay)
+        logger.exception('Job %d failed. Retrying in %.0f s if attempts are '
+                         'left.', job['id'], delay)
+        return
+    result['elapsed'] = round(time.monotonic() - start, 3)
+    jobs.complete(job['id'], result)
+    logger.info('Job %d done in %.1f s', job['id'], result['elapsed'],
+                extra={'phase': 'job', 'elapsed': result['elapsed'],
+                       'records': result['filled']})
+
+
+def worker(jobs, bucket, retry_base, stop):
+    while not stop.is_set():
+        job = jobs.claim()
+        if job is None:
+            wait = jobs.next_wait()
+            if wait is None:
+                return
+            stop.wait(min(max(wait, 1.0), 10.0))
+            continue
+        run_job(jobs, job, bucket, retry_base)
+
+
+def run_queue(jobs, workers=1, rate=1.0, burst=2, retry_base=30):
+    """Run all queued jobs with `workers` threads until the queue drains."""
+    # Jobs left running belong to an interrupted runner
+    requeued = jobs.requeue(('running',))
+    if requeued:
+        logger.warning('%d interrupted jobs queued again.', requeued)
+    bucket = TokenBucket(rate, burst)
+    stop = threading.Event()
+    threads = [threading.Thread(target=worker, name='worker-' + str(i + 1),
+                                args=(jobs, bucket, retry_base, stop))
+               for i in range(workers)]
+    for thread in threads:
+        thread.start()
+    try:
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(1)
+    except (KeyboardInterrupt, SystemExit):
+        logger.warning('Interrupted. Waiting for running jobs to finish.')
+        stop.set()
+        for thread in threads:
+            thread.join()
+    logger.info('Queue finished: %s', jobs.counts())
+
+
+def print_status(jobs):
+    counts = jobs.counts()
+    print(', '.join(status + ': ' + str(counts.get(status, 0))
+                    for status in ('queued', 'running', 'done', 'failed')))
+    for job in jobs.jobs():
+        if job['started'] and job['finished']:
+            duration = '%.0f s' % (job['finished'] - job['started'])
+        else:
+            duration = '-'
+        if job['status'] == 'queued' and job['next_run'] > time.time():
+            duration = 'due ' + datetime.datetime.fromtimestamp(
+                job['next_run']).strftime('%H:%M:%S')
+        print('%4d  %-8s %d/%d  %-10s %-30s %s' % (
+            job['id'], job['status'], job['attempts'], job['max_attempts'],
+            duration, job['pi_name'][:30], (job['last_error'] or '')[:60]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Queue and run grant record '
+                                                 'filling jobs for many PIs.')
+    parser.add_argument('-q', '--queue', metavar='QUEUE_FILE', type=str,
+                        default='rgc-jobs.db', help='SQLite job queue file')
+    parser.add_argument('--version', '-v', action='version',
+                        version='%(prog)s ' + __version__)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    add = commands.add_parser('add', help='Queue a job')
+    add.add_argument('-u', '--user_id', metavar='USER_ID', type=str,
+                     required=True, help='User ID')
+    add.add_argument('--pw_env', metavar='ENV_VAR', type=str, required=True,
+                     help='Environment variable holding the password')
+    add.add_argument('-n', '--pi_name', metavar='PI_NAME', type=str,
+                     required=True,
+                     help='PI name. Add double quotes, e.g. "Chan, Tai-man"')
+    add.add_argument('-i', '--input', metavar='EXCEL_FILE_PATH', type=str,
+                     required=True,
+                     help='Input Excel file or grant store directory')
+    add.add_argument('--max_attempts', type=int, default=3,
+                     help='Attempts before the job is marked failed')
+    add.add_argument('options', nargs=argparse.REMAINDER,
+                     help='Options for auto_grant_rec.py after --')
+
+    run = commands.add_parser('run', help='Run all queued jobs')
+    run.add_argument('-w', '--workers', type=int, default=1,
+                     help='Number of parallel browser workers')
+    run.add_argument('-r', '--rate', type=float, default=1.0,
+                     help='Page transitions per second across all workers')
+    run.add_argument('--burst', type=int, default=2,
+                     help='Page transitions allowed in a burst')
+    run.add_argument('--plan', metavar='PLAN_PATH', type=str,
+                     help='Log the wall time of the batch against a plan '
+                          'from auto_grant_rec_plan.py')
+    run.add_argument('--retry_base', type=float, default=30,
+                     help='Base retry delay in seconds, doubled per attempt')
+    run.add_argument('-l', '--log_path', metavar='LOG_FILE_PATH', type=str,
+                     default=datetime.datetime.now().strftime(
+                         '%Y%m%d-%H%M%S') + '-rgc-batch.log',
+                     help='path to run log')
+    run.add_argument('--log_level', metavar='COMPONENT=LEVEL',
+                     type=auto_grant_rec.log_level_arg, action='append',
+                     default=[],
+                     help='Set the log level of one component')
+    run.add_argument('--verbose', nargs='?', type=int, const=1, default=0,
+                     help='Add this argument to log debug messages')
+
+    commands.add_parser('status', help='Show the state of all jobs')
+    retry = commands.add_parser('retry', help='Queue failed jobs again')
+    retry.add_argument('--all', action='store_true',
+                       help='Also queue finished jobs again')
+    args = parser.parse_args()
+
+    jobs = JobQueue(args.queue)
+    if args.command == 'add':
+        options = args.options[1:] if args.options[:1] == ['--'] \
+            else args.options
+        try:
+            parse_job_args(args.user_id, '-', args.pi_name, args.input,
+                           options)
+        except SystemExit:
+            parser.error('invalid options for auto_grant_rec.py: ' +
+                         ' '.join(options))
+        job_id = jobs.add(args.user_id, args.pw_env, args.pi_name, args.input,
+                          options, args.max_attempts)
+        print('Job ' + str(job_id) + ' queued.')
+    elif args.command == 'run':
+        auto_grant_rec.setup_logging(args.log_path, args.verbose, 'json',
+                                     args.log_level)
+        auto_grant_rec.exit_on_sigterm()
+        start = time.monotonic()
+        run_queue(jobs, args.workers, args.rate, args.burst, args.retry_base)
+        if args.plan:
+            import auto_grant_rec_plan
+            auto_grant_rec_plan.report_batch(args.plan,
+                                             time.monotonic() - start)
+    elif args.command == 'status':
+        print_status(jobs)
+    elif args.command == 'retry':
+        statuses = ('failed', 'done') if args.all else ('failed',)
+        print(str(jobs.requeue(statuses)) + ' jobs queued again.')
+
+
+if __name__ == '__main__':
+    main()
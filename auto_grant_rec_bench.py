@@ -0,0 +1,544 @@
+"""
+RGC application grant record auto-filler (browser benchmark)
+==
+
+Runs the same synthetic grant record workload on every available browser
+backend and reports its startup time, per-record latency and peak memory,
+to pick the fastest engine for a server. The workload runs against a local
+stand-in of the online system, so no RGC account is needed and the real
+server is not loaded.
+
+## Dependencies
+Same as `auto_grant_rec.py`, plus the browsers and drivers to compare,
+e.g. Chrome with chromedriver and Firefox with geckodriver. `psutil` is
+used for memory readings if installed, otherwise `/proc` is read on Linux.
+
+## Usage
+- Compare all available browsers on 20 records:
+  `python3 auto_grant_rec_bench.py -n 20`
+- Compare given browsers and drivers, and keep the results:
+  `python3 auto_grant_rec_bench.py -b chrome firefox
+   --chromedriver_path /path/to/chromedriver --json bench.json`
+- Soak test the browser worker on 1000 records, restarting the browser every
+  200 records, and fail if its memory grows by more than 25%:
+  `python3 auto_grant_rec_bench.py -b chrome --soak 1000 --recycle_after 200`
+- Serve the stand-in system for manual runs of `auto_grant_rec.py` with
+  `--login_url http://127.0.0.1:8765/cergprod/login.jsp`:
+  `python3 auto_grant_rec_bench.py --serve 8765`
+"""
+
+__author__ = 'Claire Chung'
+__version__ = '1.3'
+__license__ = "MIT License"
+
+import argparse
+import datetime
+import html
+import http.server
+import json
+import logging
+import statistics
+import sys
+import threading
+import time
+import urllib.parse
+
+import auto_grant_rec
+
+logger = logging.getLogger('auto_grant_rec.bench')
+
+
+### Stand-in of the online system ###
+
+page_template = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>{title}</title></head>
+<body>{body}</body></html>"""
+
+# Shown on every page after the terms, as online. A <button> so that it is not
+# taken for a record button.
+menu_template = """
+<button type="button" name="ProposalMenu"
+    onclick="document.getElementById('menu').style.display = 'block';"
+    >Proposal Menu</button>
+<div id="menu" style="display: none">
+<a href="/cergprod/grant"
+    >Grant Record and Related Research Work of Investigator(s)</a>
+</div>"""
+
+form_template = """
+<form method="post" action="/cergprod/save">
+<input type="hidden" name="id" value="{id}">
+Name of Investigator(s): <input type="text" name="piName" id="piName"
+    value="{piName}"><br>
+Capacity: <select name="capacity" onchange="toggleHours()">{capacity}</select>
+<br>
+Funding Sources:
+<input type="radio" name="fund_src_flag" id="fund_src_flag_Y" value="Y"
+    {fund_src_flag_Y}>GRF/ECS
+<input type="radio" name="fund_src_flag" id="fund_src_flag_N" value="N"
+    {fund_src_flag_N}>Others
+<input type="text" name="fund_src" value="{fund_src}"><br>
+Status: <select name="proj_status" id="proj_status"
+    onchange="toggleHours()">{proj_status}</select><br>
+Project Reference No.: <input type="text" name="ref_no" value="{ref_no}"><br>
+Project / Work Title: <input type="text" name="proj_title"
+    value="{proj_title}"><br>
+Funding Amount (HK$): <input type="text" name="fund_amt"
+    value="{fund_amt}"><br>
+UGC/RGC Funding:
+<input type="radio" name="ugcfunding" id="ugcfunding_Y" value="Y"
+    {ugcfunding_Y}>Yes
+<input type="radio" name="ugcfunding" id="ugcfunding_N" value="N"
+    {ugcfunding_N}>No<br>
+Start Date: <select name="s_day">{s_day}</select>
+<select name="s_month">{s_month}</select>
+<select name="s_year">{s_year}</select><br>
+Estimated / Completion Date: <select name="c_day">{c_day}</select>
+<select name="c_month">{c_month}</select>
+<select name="c_year">{c_year}</select><br>
+Number of Hours: <input type="text" name="workHourPer" id="workHourPer"
+    value="{workHourPer}"><br>
+Project / Work Objective: <textarea name="projectObjective"
+    >{projectObjective}</textarea><br>
+Related to the current application:
+<input type="radio" name="overlap" id="overlap_NA" value="NA"
+    {overlap_NA}>N/A
+<input type="radio" name="overlap" id="overlap_RE" value="RE"
+    {overlap_RE}>Related<br>
+<input type="submit" name="add" value="Save">
+<input type="button" name="del" value="Delete" onclick="if (confirm(
+    'Delete this record?')) {{ this.form.action = '/cergprod/delete';
+    this.form.submit(); }}">
+</form>
+<script>
+function toggleHours() {{
+    var form = document.forms[0];
+    form.workHourPer.disabled = form.capacity.value === 'C'
+        || form.proj_status.value === 'U';
+}}
+toggleHours();
+</script>
+"""
+
+form_selects = {'capacity': ['', 'P', 'PC', 'C', 'Co-PI'],
+                'proj_status': ['', 'O', 'Z', 'U'],
+                's_day': [''] + [str(d) for d in range(1, 32)],
+                's_month': [''] + [str(m) for m in range(1, 13)],
+                's_year': [''] + [str(y) for y in range(1990, 2041)]}
+form_selects['c_day'] = form_selects['s_day']
+form_selects['c_month'] = form_selects['s_month']
+form_selects['c_year'] = form_selects['s_year']
+form_radios = {'fund_src_flag': ['Y', 'N'], 'ugcfunding': ['Y', 'N'],
+               'overlap': ['NA', 'RE']}
+form_texts = ['piName', 'fund_src', 'ref_no', 'proj_title', 'fund_amt',
+              'workHourPer', 'projectObjective']
+
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serves the pages of the online system that the filler walks through,
+    with the same element names, ids, link texts and button values.
+    """
+
+    def log_message(self, format, *args):
+        logger.debug('Stand-in: ' + format, *args)
+
+    def send_page(self, title, body):
+        content = page_template.format(title=title, body=body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def redirect(self, path):
+        self.send_response(303)
+        self.send_header('Location', path)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        if url.path == '/cergprod/login.jsp':
+            self.send_page('Login', """
+<form method="post" action="/cergprod/login">
+User ID: <input type="text" name="uid" maxlength="20"><br>
+Password: <input type="password" name="pwd"><br>
+<input type="submit" name="submit" value="Login">
+</form>""")
+        elif url.path == '/cergprod/role':
+            self.send_page('Role', """
+<form method="get" action="/cergprod/menu">
+<input type="radio" name="role" value="PI" checked>Investigator
+<input type="submit" name="Continue" value="Continue">
+</form>""")
+        elif url.path == '/cergprod/menu':
+            self.send_page('Project Maintenance', """
+<a href="/cergprod/terms" target="_blank"
+    >Prepare Proposal / View Internal Comments</a>""")
+        elif url.path == '/cergprod/terms':
+            self.send_page('Terms', """
+<input type="button" name="yes" value="I accept"
+    onclick="window.opener.location = '/cergprod/proposal';
+    window.close();">""")
+        elif url.path == '/cergprod/proposal':
+            self.send_page('Proposal', menu_template)
+        elif url.path == '/cergprod/grant':
+            self.send_page('Grant Record', self.record_list() + menu_template)
+        elif url.path == '/cergprod/form':
+            record_id = query.get('id', [''])[0]
+            with self.server.lock:
+                record = dict(self.server.records.get(record_id, {}))
+            self.send_page('Grant Record Form',
+                           self.record_form(record_id, record) + menu_template)
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        fields = urllib.parse.parse_qs(self.rfile.read(length).decode(),
+                                       keep_blank_values=True)
+        values = {name: fields[name][0] for name in fields}
+        url = urllib.parse.urlsplit(self.path)
+        if url.path == '/cergprod/login':
+            self.redirect('/cergprod/role')
+        elif url.path == '/cergprod/save':
+            with self.server.lock:
+                record_id = values.pop('id', '')
+                if record_id not in self.server.records:
+                    self.server.next_id += 1
+                    record_id = str(self.server.next_id)
+                self.server.records[record_id] = values
+            self.redirect('/cergprod/grant')
+        elif url.path == '/cergprod/delete':
+            with self.server.lock:
+                self.server.records.pop(values.get('id', ''), None)
+            self.redirect('/cergprod/grant')
+        else:
+            self.send_error(404)
+
+    def record_list(self):
+        with self.server.lock:
+            records = list(self.server.records.items())
+        # Record buttons come first, as the filler expects
+        buttons = []
+        for record_id, record in records:
+            value = record.get('ref_no') or 'REC%05d' % int(record_id)
+            buttons.append(
+                '<input type="button" value="%s" onclick="location = '
+                '\'/cergprod/form?id=%s\';"><br>' % (html.escape(value),
+                                                     record_id))
+        buttons.append(
+            '<input type="button" value=" Add Project / Work (GRF/ECS &amp; '
+            'non-GRF/non-ECS) " onclick="location = \'/cergprod/form\';">')
+        return '\n'.join(buttons)
+
+    def record_form(self, record_id, record):
+        values = {'id': record_id}
+        for name in form_texts:
+            values[name] = html.escape(record.get(name, ''))
+        for name, options in form_selects.items():
+            values[name] = ''.join(
+                '<option value="%s"%s>%s</option>' % (
+                    option, ' selected' if record.get(name) == option else '',
+                    option or '--') for option in options)
+        for name, options in form_radios.items():
+            for option in options:
+                values[name + '_' + option] = \
+                    'checked' if record.get(name) == option else ''
+        return form_template.format(**values)
+
+
+class StandInServer(http.server.ThreadingHTTPServer):
+    """Local stand-in of the online system keeping records in memory."""
+    daemon_threads = True
+
+    def __init__(self, port=0):
+        super().__init__(('127.0.0.1', port), StandInHandler)
+        self.lock = threading.Lock()
+        self.records = {}
+        self.next_id = 0
+        self.thread = None
+
+    @property
+    def login_url(self):
+        return 'http://127.0.0.1:%d/cergprod/login.jsp' % self.server_port
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever,
+                                       name='stand-in', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+### Workload ###
+
+
+def synthetic_rows(n):
+    """Grant record rows covering the roles, statuses and funding sources."""
+    roles = ['PI', 'Co-I', 'PC', 'Co-PI']
+    statuses = ['On-going', 'Completed', 'Pending']
+    rows = []
+    for i in range(n):
+        status = statuses[i % len(statuses)]
+        grf = i % 2 == 0
+        rows.append({
+            'Reference number': 'BENCH%04d' % (i + 1),
+            'Project title': 'Synthetic study number %d' % (i + 1),
+            'Role': roles[i % len(roles)],
+            'Funding source': 'GRF' if grf else 'Some Funding Scheme',
+            'Amount (HK$)': 100000 * (i % 9 + 1),
+            'UGC/RGC funding': 'Y' if grf or i % 3 == 0 else 'N',
+            'Start date': datetime.datetime(2019 + i % 4, i % 12 + 1,
+                                            i % 28 + 1),
+            'End date': datetime.datetime(2023 + i % 4, (i + 5) % 12 + 1,
+                                          (i + 9) % 28 + 1),
+            'Number of hours': i % 5 + 1,
+            'Status': status,
+            'Project Objectives': 'To study synthetic objective %d. ' % i * 8,
+        })
+    return rows
+
+
+class RSSSampler(threading.Thread):
+    """Samples the memory of a driver's process tree in the background."""
+
+    def __init__(self, driver, interval=0.2):
+        super().__init__(name='rss-sampler', daemon=True)
+        self.driver = driver
+        self.interval = interval
+        self.peak = 0
+        self.samples = []
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            rss = auto_grant_rec.driver_rss(self.driver)
+            self.samples.append(rss)
+            self.peak = max(self.peak, rss)
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        return self.peak
+
+
+def bench_backend(backend, server, rows, driver_path=None, readiness='poll',
+                  verify='inline'):
+    """Run the workload on one backend and return its measurements."""
+    start = time.monotonic()
+    driver = backend.start(driver_path, headless=True)
+    startup = time.monotonic() - start
+    sampler = RSSSampler(driver)
+    sampler.start()
+    try:
+        session = auto_grant_rec.RGCSession(driver, readiness=readiness,
+                                            login_url=server.login_url)
+        start = time.monotonic()
+        session.login('bench', 'bench')
+        session.open_grant_records()
+        session.clear_records_bulk()
+        login = time.monotonic() - start
+
+        latencies = []
+        inputdicts = []
+        for row in rows:
+            inputdict = auto_grant_rec.build_inputdict(row, 'BENCH, Tai-man')
+            start = time.monotonic()
+            session.fill_record(inputdict, verify=verify == 'inline')
+            latencies.append(time.monotonic() - start)
+            inputdicts.append(inputdict)
+        if verify == 'deferred':
+            start = time.monotonic()
+            session.verify_records(inputdicts)
+            verify_time = time.monotonic() - start
+        else:
+            verify_time = 0.0
+    finally:
+        peak = sampler.stop()
+        driver.quit()
+    return {'backend': backend.name,
+            'startup_s': round(startup, 3),
+            'login_s': round(login, 3),
+            'records': len(rows),
+            'record_mean_ms': round(statistics.mean(latencies) * 1000, 1),
+            'record_median_ms': round(statistics.median(latencies) * 1000, 1),
+            'record_max_ms': round(max(latencies) * 1000, 1),
+            'verify_s': round(verify_time, 3),
+            'peak_rss_mb': round(peak / 2 ** 20, 1)}
+
+
+def soak_backend(backend, server, records, driver_path=None,
+                 readiness='poll', recycle_after=0, recycle_rss=0,
+                 clear_every=50, sample_every=50):
+    """
+    Fill `records` records through one BrowserWorker and sample its memory.
+
+    The saved records are cleared every `clear_every` records, as in
+    repeated runs for one PI, so that only the browser and not the record
+    list grows. Memory is sampled after every `sample_every` records.
+    """
+    rows = synthetic_rows(clear_every)
+    worker = auto_grant_rec.BrowserWorker(
+        lambda: backend.start(driver_path, headless=True), 'bench', 'bench',
+        recycle_after=recycle_after, recycle_rss=recycle_rss,
+        readiness=readiness, login_url=server.login_url)
+    samples = []
+    start = time.monotonic()
+    with worker:
+        worker.start()
+        worker.session.clear_records_bulk()
+        for i in range(records):
+            inputdict = auto_grant_rec.build_inputdict(rows[i % len(rows)],
+                                                       'BENCH, Tai-man')
+            worker.fill_record(inputdict)
+            if (i + 1) % clear_every == 0:
+                worker.session.clear_records_bulk()
+            if (i + 1) % sample_every == 0:
+                samples.append([i + 1, round(worker.rss(), 1)])
+                logger.info('Soak: %d records, %.1f MB', *samples[-1])
+    # Compare the last quarter of the samples with the first, skipping the
+    # first sample while the browser warms up
+    steady = samples[1:] or samples
+    quarter = max(len(steady) // 4, 1)
+    first = statistics.mean(rss for _, rss in steady[:quarter])
+    last = statistics.mean(rss for _, rss in steady[-quarter:])
+    return {'backend': backend.name,
+            'records': records,
+            'seconds': round(time.monotonic() - start, 1),
+            'recycled': worker.recycled,
+            'first_rss_mb': round(first, 1),
+            'last_rss_mb': round(last, 1),
+            'peak_rss_mb': max(rss for _, rss in samples),
+            'growth_pct': round((last - first) / first * 100, 1)
+            if first else 0.0,
+            'samples': samples}
+
+
+def print_results(results):
+    print('%-8s %9s %9s %12s %12s %12s %10s' % (
+        'backend', 'start s', 'login s', 'mean ms/rec', 'median ms',
+        'max ms', 'peak MB'))
+    for result in results:
+        print('%-8s %9.2f %9.2f %12.1f %12.1f %12.1f %10.1f' % (
+            result['backend'], result['startup_s'], result['login_s'],
+            result['record_mean_ms'], result['record_median_ms'],
+            result['record_max_ms'], result['peak_rss_mb']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare browser backends '
+                                                 'on a synthetic grant record '
+                                                 'workload.')
+    parser.add_argument('-b', '--browsers', nargs='+',
+                        choices=list(auto_grant_rec.backends),
+                        help='Backends to compare (default: all available)')
+    parser.add_argument('-n', '--records', type=int, default=20,
+                        help='Number of synthetic records per backend')
+    parser.add_argument('--chromedriver_path', type=str, default=None,
+                        help='path to chromedriver')
+    parser.add_argument('--geckodriver_path', type=str, default=None,
+                        help='path to geckodriver')
+    parser.add_argument('--readiness', choices=['poll', 'observer'],
+                        default='poll', help='Page readiness mode')
+    parser.add_argument('--verify', choices=['inline', 'deferred'],
+                        default='inline', help='Verification mode')
+    parser.add_argument('--soak', metavar='RECORDS', type=int,
+                        help='Soak test the browser worker of the first '
+                             'backend on this many records instead')
+    parser.add_argument('--recycle_after', metavar='RECORDS', type=int,
+                        default=0,
+                        help='With --soak, restart the browser after this '
+                             'many records')
+    parser.add_argument('--recycle_rss', metavar='MB', type=int, default=0,
+                        help='With --soak, restart the browser above this '
+                             'memory')
+    parser.add_argument('--soak_tolerance', metavar='PERCENT', type=float,
+                        default=25.0,
+                        help='With --soak, fail if the memory grows by more '
+                             'than this')
+    parser.add_argument('--json', metavar='JSON_PATH', type=str,
+                        help='Also write the results to a JSON file')
+    parser.add_argument('--serve', metavar='PORT', type=int,
+                        help='Only serve the stand-in system on PORT')
+    parser.add_argument('--verbose', nargs='?', type=int, const=1, default=0,
+                        help='Add this argument to log debug messages')
+    parser.add_argument('--version', '-v', action='version',
+                        version='%(prog)s ' + __version__)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose
+                        else logging.WARNING)
+    logger.setLevel(logging.DEBUG if args.verbose else logging.INFO)
+
+    if args.serve is not None:
+        server = StandInServer(args.serve)
+        print('Serving the stand-in system at ' + server.login_url)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.server_close()
+        return
+
+    driver_paths = {'chrome': args.chromedriver_path,
+                    'firefox': args.geckodriver_path}
+    names = args.browsers or [name for name, backend
+                              in auto_grant_rec.backends.items()
+                              if backend.available(driver_paths.get(name))]
+    if not names:
+        parser.error('no browser backend available')
+
+    if args.soak:
+        name = names[0]
+        server = StandInServer().start()
+        try:
+            logger.info('Soak testing %s on %d records', name, args.soak)
+            result = soak_backend(auto_grant_rec.backends[name], server,
+                                  args.soak, driver_paths.get(name),
+                                  args.readiness, args.recycle_after,
+                                  args.recycle_rss)
+        finally:
+            server.stop()
+        print('%s: %d records in %.0f s, %d recycles, memory %.1f -> %.1f MB '
+              '(%+.1f%%), peak %.1f MB' % (
+                  result['backend'], result['records'], result['seconds'],
+                  result['recycled'], result['first_rss_mb'],
+                  result['last_rss_mb'], result['growth_pct'],
+                  result['peak_rss_mb']))
+        if args.json:
+            with open(args.json, 'w', encoding='utf-8') as f:
+                json.dump(result, f, indent=1)
+        if result['growth_pct'] > args.soak_tolerance:
+            print('Memory grew by more than %.0f%%.' % args.soak_tolerance)
+            sys.exit(1)
+        return
+
+    rows = synthetic_rows(args.records)
+
+    results = []
+    for name in names:
+        server = StandInServer().start()
+        try:
+            logger.info('Benchmarking %s on %d records', name, len(rows))
+            results.append(bench_backend(auto_grant_rec.backends[name],
+                                         server, rows, driver_paths.get(name),
+                                         args.readiness, args.verify))
+        except Exception:
+            logger.exception('Benchmark of %s failed', name)
+        finally:
+            server.stop()
+
+    print_results(results)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
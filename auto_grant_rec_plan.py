@@ -0,0 +1,443 @@
+"""
+RGC application grant record auto-filler (run planner)
+==
+
+Predicts how long filling jobs will take from how earlier runs performed,
+and recommends the number of batch workers and the rate limit. The JSON run
+logs of `auto_grant_rec.py` and `auto_grant_rec_batch.py` record the wall
+time of each run phase and of each filled record with its number of typed
+characters. From these, a cost model is fitted:
+- login: seconds per run, including the browser start
+- clear and verify: seconds per run plus seconds per record
+- fill: seconds per record plus seconds per typed character, so that e.g.
+  long project objectives are accounted for
+- check: seconds per run
+
+Profile reports written by `--profile` can be read as well, but only
+contribute their phase totals.
+
+## Dependencies
+Same as `auto_grant_rec.py`.
+
+## Usage
+- Show the cost model fitted from past run logs:
+  `python3 auto_grant_rec_plan.py model *-rgc-grantrec.log`
+- Predict the jobs of some workbooks, or of the queued batch jobs, and keep
+  the plan:
+  `python3 auto_grant_rec_plan.py predict -l *-rgc-grantrec.log
+   -i chan.xlsx wong.xlsx -o plan.json`
+  `python3 auto_grant_rec_plan.py predict -l batch.log --queue rgc-jobs.db
+   --max_rate 2 -o plan.json`
+- Pass the plan to the runs, e.g. as a batch job option `-- --plan
+  plan.json` and to `auto_grant_rec_batch.py run --plan plan.json`. Each run
+  then logs its wall time against the prediction. Summarize them by
+  `python3 auto_grant_rec_plan.py compare batch.log`
+
+## Remarks
+- Only JSON run logs are read. Runs with `--log_format text` are skipped.
+- Predictions assume that as many records as in the input exist online
+  from an earlier upload and are cleared first. Use `--existing` otherwise.
+- `--max_rate` is the rate of page transitions per second that the server
+  is known to take. The recommended rate never exceeds it.
+"""
+
+__author__ = 'Claire Chung'
+__version__ = '1.3'
+__license__ = "MIT License"
+
+import argparse
+import datetime
+import heapq
+import json
+import logging
+import math
+import os
+import statistics
+
+import auto_grant_rec
+
+logger = logging.getLogger('auto_grant_rec.plan')
+
+# Page transitions, i.e. requests throttled by the batch rate limit, of the
+# login, of each record cleared or filled and of each record read back by
+# --verify deferred
+login_transitions = 6
+record_transitions = 2
+verify_transitions = 2
+model_phases = ['login', 'clear', 'fill', 'verify', 'check']
+
+
+def linear_fit(points):
+    """
+    Least-squares intercept and slope of (x, y) points.
+
+    Without spread in x, or with a negative slope, the mean of y is
+    returned as intercept.
+    """
+    if not points:
+        return 0.0, 0.0
+    xs = [x for x, _ in points]
+    ys = [y for _, y in points]
+    mean_x = statistics.mean(xs)
+    mean_y = statistics.mean(ys)
+    var_x = sum((x - mean_x) ** 2 for x in xs)
+    if var_x == 0:
+        return mean_y, 0.0
+    slope = sum((x - mean_x) * (y - mean_y) for x, y in points) / var_x
+    if slope < 0:
+        return mean_y, 0.0
+    return mean_y - slope * mean_x, slope
+
+
+class CostModel:
+    """Per-phase cost model fitted from past runs."""
+
+    def __init__(self):
+        self.phase_samples = {phase: [] for phase in model_phases}
+        self.record_samples = []
+        self.runs = 0
+        self.coefficients = {}
+
+    def add_phase(self, phase, seconds, records=None):
+        if phase in self.phase_samples:
+            self.phase_samples[phase].append((records or 0, seconds))
+            if phase == 'login':
+                self.runs += 1
+
+    def add_record(self, chars, seconds):
+        self.record_samples.append((chars, seconds))
+
+    def read_log(self, log_path):
+        """Add the samples of a JSON run log or a profile report."""
+        with open(log_path, encoding='utf-8') as f:
+            text = f.read()
+        try:
+            report = json.loads(text)
+        except ValueError:
+            report = None
+        if isinstance(report, dict) and 'phases' in report:
+            for phase, entry in report['phases'].items():
+                self.add_phase(phase, entry['seconds'], entry.get('records'))
+            return
+        for line in text.splitlines():
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if not isinstance(entry, dict) or 'elapsed' not in entry:
+                continue
+            if entry.get('phase') == 'record':
+                self.add_record(entry.get('chars', 0), entry['elapsed'])
+            else:
+                self.add_phase(entry.get('phase'), entry['elapsed'],
+                               entry.get('records'))
+
+    def fit(self):
+        if not self.phase_samples['login']:
+            raise ValueError('No login phase found. Please pass JSON run '
+                             'logs of completed runs.')
+        c = {'login': statistics.mean(
+                 s for _, s in self.phase_samples['login']),
+             'check': statistics.mean(
+                 s for _, s in self.phase_samples['check'])
+             if self.phase_samples['check'] else 0.0}
+        for phase in ('clear', 'verify'):
+            c[phase + '_run'], c[phase + '_record'] = linear_fit(
+                self.phase_samples[phase])
+        if self.record_samples:
+            c['fill_record'], c['fill_char'] = linear_fit(self.record_samples)
+        else:
+            # Profile reports only give the fill phase totals
+            records = sum(r for r, _ in self.phase_samples['fill'])
+            seconds = sum(s for _, s in self.phase_samples['fill'])
+            c['fill_record'] = seconds / records if records else 0.0
+            c['fill_char'] = 0.0
+        self.coefficients = c
+        return self
+
+    def predict(self, chars, existing=None, verify=False):
+        """
+        Predicted seconds per phase of a job filling records with the given
+        numbers of typed characters, after clearing `existing` records.
+        """
+        c = self.coefficients
+        if existing is None:
+            existing = len(chars)
+        phases = {'login': c['login'],
+                  'clear': c['clear_run'] + c['clear_record'] * existing,
+                  'fill': sum(c['fill_record'] + c['fill_char'] * n
+                              for n in chars),
+                  'check': c['check']}
+        if verify:
+            phases['verify'] = c['verify_run'] + c['verify_record'] * \
+                len(chars)
+        return phases
+
+    def describe(self):
+        c = self.coefficients
+        return {'runs': self.runs, 'records': len(self.record_samples),
+                'coefficients': {k: round(v, 4) for k, v in c.items()}}
+
+
+def job_options(input_path, pi_name='', options=()):
+    """Filler options of a job, as parsed by auto_grant_rec.py."""
+    return auto_grant_rec.build_parser().parse_args(
+        ['-u', '-', '-p', '-', '-n', pi_name, '-i', input_path] +
+        list(options))
+
+
+def job_chars(args):
+    """Typed characters of each record the job fills."""
+    records = auto_grant_rec.load_records(args.input, args.pi_name,
+                                          args.input_format)
+    if args.spec:
+        import auto_grant_rec_spec
+        plan = auto_grant_rec_spec.compile_spec(args.spec)
+        return [auto_grant_rec.record_chars(
+                    plan.values(row, {'pi_name': args.pi_name}))
+                for row in records]
+    return [auto_grant_rec.record_chars(auto_grant_rec.expected_form_values(
+                auto_grant_rec.build_inputdict(row, args.pi_name)))
+            for row in records]
+
+
+def makespan(durations, workers):
+    """
+    Wall time of jobs taken in order by the first free of `workers`
+    workers, as the batch queue does.
+    """
+    finish = [0.0] * workers
+    for duration in durations:
+        heapq.heappush(finish, heapq.heappop(finish) + duration)
+    return max(finish)
+
+
+def recommend(jobs, max_workers, max_rate):
+    """
+    Smallest worker count that comes within 5% of the shortest batch wall
+    time, with the rate limit it needs. Returns (workers, rate, seconds).
+    """
+    durations = [job['seconds'] for job in jobs]
+    transitions = sum(job['transitions'] for job in jobs)
+    spans = {}
+    for workers in range(1, max(min(max_workers, len(jobs)), 1) + 1):
+        # The shared rate limit stretches the batch if the workers would
+        # send more page transitions than it allows
+        spans[workers] = max(makespan(durations, workers),
+                             transitions / max_rate)
+    best = min(spans.values())
+    workers = min(w for w, span in spans.items() if span <= best * 1.05)
+    demand = transitions / sum(durations) * workers if durations else 0
+    rate = min(max_rate, math.ceil(demand * 10) / 10 or max_rate)
+    return workers, rate, spans[workers]
+
+
+def predict(model, jobs, existing=None, max_workers=None, max_rate=1.0):
+    """Predict the given jobs and recommend how to run them."""
+    predicted = []
+    for args in jobs:
+        chars = job_chars(args)
+        verify = args.verify == 'deferred' and not args.spec
+        phases = model.predict(chars, existing, verify=verify)
+        cleared = len(chars) if existing is None else existing
+        predicted.append({
+            'input': os.path.abspath(args.input),
+            'pi_name': args.pi_name,
+            'records': len(chars),
+            'chars_per_record': round(statistics.mean(chars), 1)
+            if chars else 0,
+            'phases': {k: round(v, 1) for k, v in phases.items()},
+            'seconds': round(sum(phases.values()), 1),
+            'transitions': login_transitions +
+            record_transitions * (cleared + len(chars)) +
+            verify_transitions * len(chars) * verify})
+    workers, rate, seconds = recommend(predicted,
+                                       max_workers or os.cpu_count() or 1,
+                                       max_rate)
+    return {'created': datetime.datetime.now().isoformat(timespec='seconds'),
+            'model': model.describe(),
+            'jobs': predicted,
+            'work_seconds': round(sum(j['seconds'] for j in predicted), 1),
+            'workers': workers,
+            'rate': rate,
+            'seconds': round(seconds, 1)}
+
+
+def load_plan(plan_path):
+    with open(plan_path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def find_job(plan, input_path, pi_name):
+    input_path = os.path.abspath(input_path)
+    for job in plan['jobs']:
+        if job['input'] == input_path and job['pi_name'] in (pi_name, ''):
+            return job
+    return None
+
+
+def report_actual(plan_path, input_path, pi_name, elapsed, records):
+    """Log the wall time of a run against its prediction in a plan."""
+    try:
+        job = find_job(load_plan(plan_path), input_path, pi_name)
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning('Plan %s not read: %s', plan_path, e)
+        return None
+    if job is None:
+        logger.warning('No prediction for %s in %s', input_path, plan_path)
+        return None
+    logger.info('Predicted %.0f s, actual %.0f s (%+.0f%%)', job['seconds'],
+                elapsed, (elapsed - job['seconds']) / job['seconds'] * 100,
+                extra={'phase': 'plan', 'elapsed': round(elapsed, 3),
+                       'predicted': job['seconds'], 'records': records})
+    return job
+
+
+def report_batch(plan_path, elapsed):
+    """Log the wall time of a batch against the plan."""
+    try:
+        plan = load_plan(plan_path)
+    except (OSError, ValueError) as e:
+        logger.warning('Plan %s not read: %s', plan_path, e)
+        return
+    logger.info('Batch predicted %.0f s with %d workers, actual %.0f s '
+                '(%+.0f%%)', plan['seconds'], plan['workers'], elapsed,
+                (elapsed - plan['seconds']) / plan['seconds'] * 100,
+                extra={'phase': 'plan_batch', 'elapsed': round(elapsed, 3),
+                       'predicted': plan['seconds']})
+
+
+def print_plan(plan):
+    print('%-40s %8s %10s %10s' % ('job', 'records', 'chars/rec',
+                                   'predicted'))
+    for job in plan['jobs']:
+        name = os.path.basename(job['input'])
+        if job['pi_name']:
+            name += ' (' + job['pi_name'] + ')'
+        print('%-40s %8d %10.0f %8.0f s' % (name[:40], job['records'],
+                                           job['chars_per_record'],
+                                           job['seconds']))
+    print('%.0f s of work. Recommended: --workers %d --rate %g, about %.0f s '
+          'in total.' % (plan['work_seconds'], plan['workers'], plan['rate'],
+                         plan['seconds']))
+
+
+def compare(log_paths):
+    """Print the predicted and actual wall times logged by planned runs."""
+    rows = []
+    for log_path in log_paths:
+        with open(log_path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(entry, dict) and \
+                        entry.get('phase') in ('plan', 'plan_batch'):
+                    rows.append(entry)
+    if not rows:
+        print('No planned runs found. Pass --plan to the runs.')
+        return
+    errors = []
+    print('%-8s %-30s %10s %10s %8s' % ('job', 'PI', 'predicted', 'actual',
+                                        'error'))
+    for entry in rows:
+        error = (entry['elapsed'] - entry['predicted']) / \
+            entry['predicted'] * 100
+        if entry['phase'] == 'plan':
+            errors.append(abs(error))
+        print('%-8s %-30s %8.0f s %8.0f s %+7.0f%%' % (
+            'batch' if entry['phase'] == 'plan_batch'
+            else str(entry.get('job', '-')),
+            str(entry.get('pi', '-'))[:30], entry['predicted'],
+            entry['elapsed'], error))
+    if errors:
+        print('Mean absolute error per run: %.0f%%' % statistics.mean(errors))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Predict the wall time of '
+                                                 'filling jobs from past run '
+                                                 'logs.')
+    parser.add_argument('--version', '-v', action='version',
+                        version='%(prog)s ' + __version__)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    model_cmd = commands.add_parser('model', help='Show the cost model')
+    model_cmd.add_argument('logs', metavar='LOG_PATH', nargs='+',
+                           help='JSON run logs or profile reports')
+
+    predict_cmd = commands.add_parser('predict',
+                                      help='Predict jobs and recommend the '
+                                           'worker count and rate limit')
+    predict_cmd.add_argument('-l', '--logs', metavar='LOG_PATH', nargs='+',
+                             required=True,
+                             help='JSON run logs or profile reports')
+    predict_cmd.add_argument('-i', '--inputs', metavar='INPUT_PATH',
+                             nargs='+', default=[], help='Input files')
+    predict_cmd.add_argument('-n', '--pi_name', metavar='PI_NAME', type=str,
+                             default='', help='PI name of the input files')
+    predict_cmd.add_argument('--queue', metavar='QUEUE_PATH', type=str,
+                             help='Also predict the queued jobs of a batch '
+                                  'queue')
+    predict_cmd.add_argument('--existing', metavar='RECORDS', type=int,
+                             help='Records online to clear per job '
+                                  '(default: as many as in the input)')
+    predict_cmd.add_argument('--max_workers', type=int,
+                             help='Most browsers to run at once '
+                                  '(default: number of CPUs)')
+    predict_cmd.add_argument('--max_rate', type=float, default=1.0,
+                             help='Most page transitions per second the '
+                                  'server takes')
+    predict_cmd.add_argument('-o', '--output', metavar='PLAN_PATH', type=str,
+                             help='Write the plan to a JSON file')
+    predict_cmd.add_argument('options', nargs=argparse.REMAINDER,
+                             help='Options of the input files for '
+                                  'auto_grant_rec.py, after --')
+
+    compare_cmd = commands.add_parser('compare',
+                                      help='Compare predicted and actual '
+                                           'wall times of planned runs')
+    compare_cmd.add_argument('logs', metavar='LOG_PATH', nargs='+',
+                             help='JSON run logs of runs with --plan')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger('auto_grant_rec.data').setLevel(logging.ERROR)
+
+    if args.command == 'compare':
+        compare(args.logs)
+        return
+
+    model = CostModel()
+    for log_path in args.logs:
+        model.read_log(log_path)
+    try:
+        model.fit()
+    except ValueError as e:
+        parser.error(str(e))
+    if args.command == 'model':
+        print(json.dumps(model.describe(), indent=1))
+        return
+
+    options = args.options[1:] if args.options[:1] == ['--'] \
+        else args.options
+    jobs = [job_options(path, args.pi_name, options) for path in args.inputs]
+    if args.queue:
+        import auto_grant_rec_batch
+        jobs += [job_options(job['input'], job['pi_name'],
+                             json.loads(job['options']))
+                 for job in auto_grant_rec_batch.JobQueue(args.queue).jobs()
+                 if job['status'] in ('queued', 'failed')]
+    if not jobs:
+        parser.error('no jobs to predict. Please give -i or --queue.')
+    plan = predict(model, jobs, args.existing, args.max_workers,
+                   args.max_rate)
+    print_plan(plan)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(plan, f, indent=1, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
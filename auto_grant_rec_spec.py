@@ -0,0 +1,384 @@
+"""
+RGC application grant record auto-filler (declarative form specs)
+==
+
+The field logic of `auto_grant_rec.py` is written by hand for the grant
+record form. This script describes a form section instead by a JSON spec
+that maps input columns to form fields, and compiles the spec once into a
+fill plan. The plan sets all fields of a record and reads them back in a
+single browser call, so that other proposal sections get the same
+throughput without new hand-coded loops.
+
+`grant_record_spec.json` describes the grant record section and goes along
+with this script.
+
+## Spec format
+- `form`: locators of the button opening a blank form (`open`), of the
+  element to wait for in the form (`ready`) and of the save button
+  (`submit`), each as `[by, value]`, e.g. `["name", "add"]`.
+- `maps`: named value maps, e.g. `"role": {"PI": "P", "Co-I": "C"}`.
+- `fields`: the form fields in filling order, each with
+  - `name`: field name on the page, and `type`: text, textarea, select or
+    radio. Radio values are given by their id suffix, e.g. Y for
+    `ugcfunding_Y`.
+  - `column`: input column, `param`: run parameter, e.g. `pi_name`, or
+    `value`: constant value.
+  - `format`: text, int, refno (integers without '.0'), day, month or
+    year.
+  - `map`: name of a value map or an inline map, with optional
+    `map_default` for values not in the map.
+  - `default`: value when the input is empty or cannot be formatted, allowed
+    only if the fields in `default_if` have one of the given values.
+  - `skip_if`: skip the field if any of the given fields has one of the
+    given values.
+  - `required`, `pattern`: validation of the value.
+  - `accept`: other values accepted on read-back, e.g. '0'.
+- `rules`: record-level rules `{"if": {...}, "then": {...}}`. Whenever all
+  fields in `if` have one of the given values, so must the fields in
+  `then`.
+
+## Usage
+- Fill with a spec instead of the built-in field logic:
+  `python3 auto_grant_rec.py -u USER_ID -p PASSWD -n "CHAN, Tai-man"
+   -c /path/to/chromedriver -i yourinput.xlsx --spec grant_record_spec.json`
+- Check a spec and print the form values it gives for an input, without a
+  browser:
+  `python3 auto_grant_rec_spec.py grant_record_spec.json -i yourinput.xlsx
+   -n "CHAN, Tai-man"`
+"""
+
+__author__ = 'Claire Chung'
+__version__ = '1.3'
+__license__ = "MIT License"
+
+import argparse
+import datetime
+import json
+import re
+import sys
+
+field_types = ['text', 'textarea', 'select', 'radio']
+locator_kinds = ['id', 'name', 'xpath', 'link text', 'css selector']
+
+# Sets all fields of the plan in order, firing the events that typing and
+# clicking would fire so that the page scripts react as usual, then reads
+# them all back. Fields disabled by the page are reported instead of set.
+# Values longer than a field's maxlength are cut as typing would, so that they
+# show up in the diff.
+fill_plan_js = """
+var ops = arguments[0];
+var values = {}, disabled = [];
+function fire(el, type) {
+    el.dispatchEvent(new Event(type, {bubbles: true}));
+}
+function radio(name, value) {
+    return document.getElementById(name + '_' + value) ||
+        document.querySelector("input[type='radio'][name='" + name +
+                               "'][value='" + value + "']");
+}
+for (var i = 0; i < ops.length; i++) {
+    var name = ops[i][0], type = ops[i][1], value = ops[i][2];
+    var el = type === 'radio' ? radio(name, value) :
+        document.getElementsByName(name)[0];
+    if (!el) continue;
+    if (el.disabled) {
+        disabled.push(name);
+    } else if (type === 'radio') {
+        el.click();
+    } else {
+        el.value = el.maxLength > 0 && value.length > el.maxLength ?
+            value.slice(0, el.maxLength) : value;
+        fire(el, 'input');
+        fire(el, 'change');
+    }
+}
+for (var i = 0; i < ops.length; i++) {
+    var name = ops[i][0], type = ops[i][1], value = ops[i][2];
+    if (disabled.indexOf(name) >= 0) continue;
+    if (type === 'radio') {
+        var el = radio(name, value);
+        values[name] = el && el.checked ? value : null;
+    } else {
+        var el = document.getElementsByName(name)[0];
+        values[name] = el ? el.value : null;
+    }
+}
+return {values: values, disabled: disabled};
+"""
+
+
+class SpecError(ValueError):
+    """The spec itself is invalid."""
+
+
+def is_missing(value):
+    return value is None or value != value or value == ''
+
+
+def format_text(value):
+    return str(value)
+
+
+def format_int(value):
+    return str(int(float(value)))
+
+
+def format_refno(value):
+    # Prevents adding extra .0 as float due to Excel auto-formatting
+    try:
+        return str(int(value))
+    except ValueError:
+        return str(value)
+
+
+def format_date_part(part):
+    def format_part(value):
+        if isinstance(value, str):
+            value = datetime.datetime.fromisoformat(value)
+        return str(getattr(value, part))
+    return format_part
+
+
+formats = {'text': format_text, 'int': format_int, 'refno': format_refno,
+           'day': format_date_part('day'), 'month': format_date_part('month'),
+           'year': format_date_part('year')}
+
+
+def compile_conditions(conditions, names, where):
+    """Turn {field: [values]} into a list of (field, set of values)."""
+    if not isinstance(conditions, dict):
+        raise SpecError(where + ' must map field names to value lists')
+    compiled = []
+    for name, values in conditions.items():
+        if name not in names:
+            raise SpecError(where + ' refers to unknown field ' + name)
+        if not isinstance(values, list):
+            values = [values]
+        compiled.append((name, frozenset(str(v) for v in values)))
+    return compiled
+
+
+def any_met(conditions, values):
+    return any(values.get(name) in allowed for name, allowed in conditions)
+
+
+def all_met(conditions, values):
+    return all(values.get(name) in allowed for name, allowed in conditions)
+
+
+class PlanField:
+    """One compiled field of a fill plan."""
+
+    def __init__(self, spec, maps, names):
+        where = 'Field ' + str(spec.get('name'))
+        self.name = spec['name']
+        self.type = spec.get('type', 'text')
+        if self.type not in field_types:
+            raise SpecError(where + ' has unknown type ' + self.type)
+        sources = [key for key in ('column', 'param', 'value') if key in spec]
+        if len(sources) != 1:
+            raise SpecError(where + ' needs exactly one of column, param '
+                                    'and value')
+        self.source = sources[0]
+        self.key = spec[self.source]
+        if spec.get('format', 'text') not in formats:
+            raise SpecError(where + ' has unknown format ' + spec['format'])
+        self.format = formats[spec.get('format', 'text')]
+        value_map = spec.get('map')
+        if isinstance(value_map, str):
+            if value_map not in maps:
+                raise SpecError(where + ' refers to unknown map ' + value_map)
+            value_map = maps[value_map]
+        self.map = {str(k): str(v) for k, v in value_map.items()} \
+            if value_map is not None else None
+        self.map_default = spec.get('map_default')
+        self.default = spec.get('default')
+        self.default_if = compile_conditions(spec.get('default_if', {}),
+                                             names, where + ' default_if')
+        self.skip_if = compile_conditions(spec.get('skip_if', {}), names,
+                                          where + ' skip_if')
+        self.required = spec.get('required', False)
+        self.pattern = re.compile(spec['pattern']) if 'pattern' in spec \
+            else None
+        self.accept = set(spec.get('accept', []))
+
+    def value(self, row, params):
+        """Form value of the field for one input row."""
+        if self.source == 'value':
+            raw = self.key
+        elif self.source == 'param':
+            raw = params[self.key]
+        else:
+            if self.key not in row:
+                raise KeyError("Input has no column '" + self.key + "'")
+            raw = row[self.key]
+
+        if is_missing(raw):
+            return None
+        try:
+            value = self.format(raw)
+        except (ValueError, TypeError, AttributeError):
+            return None
+        if self.map is not None:
+            if value in self.map:
+                value = self.map[value]
+            elif self.map_default is not None:
+                value = str(self.map_default)
+            else:
+                raise ValueError(self.name + ": no mapping for '" + value +
+                                 "'")
+        return value
+
+
+class FillPlan:
+    """
+    A form spec compiled for filling.
+
+    `values` gives the form values of an input row, validated against the
+    spec, `ops` the operations that `script` runs in the browser to set and
+    read back all fields at once, and `diff` compares the read-back values.
+    """
+
+    script = fill_plan_js
+
+    def __init__(self, spec):
+        for key in ('form', 'fields'):
+            if key not in spec:
+                raise SpecError("Spec has no '" + key + "'")
+        self.section = spec.get('section', '')
+        self.locators = {}
+        for key in ('open', 'ready', 'submit'):
+            locator = spec['form'].get(key)
+            if not (isinstance(locator, list) and len(locator) == 2 and
+                    locator[0] in locator_kinds):
+                raise SpecError("Form locator '" + key + "' must be [by, "
+                                "value] with by one of " +
+                                ', '.join(locator_kinds))
+            self.locators[key] = tuple(locator)
+        names = [field.get('name') for field in spec['fields']]
+        if len(set(names)) != len(names) or None in names:
+            raise SpecError('Every field needs a unique name')
+        maps = spec.get('maps', {})
+        self.fields = [PlanField(field, maps, names)
+                       for field in spec['fields']]
+        self.rules = []
+        for i, rule in enumerate(spec.get('rules', [])):
+            where = 'Rule ' + str(i + 1)
+            self.rules.append((compile_conditions(rule.get('if', {}), names,
+                                                  where),
+                               compile_conditions(rule.get('then', {}),
+                                                  names, where)))
+        self.accept = {field.name: field.accept for field in self.fields
+                       if field.accept}
+
+    def values(self, row, params):
+        """
+        Validated form values of one input row, in filling order.
+
+        Skipped fields are left out. Raises ValueError if the row breaks a
+        validation rule of the spec.
+        """
+        values = {}
+        defaulted = []
+        for field in self.fields:
+            value = field.value(row, params)
+            if value is None and field.default is not None:
+                value = str(field.default)
+                defaulted.append(field)
+            values[field.name] = value
+        for field in defaulted:
+            if field.default_if and not all_met(field.default_if, values):
+                raise ValueError(field.name + ': no valid value, and the '
+                                              'default is not allowed here')
+        for field in self.fields:
+            value = values[field.name]
+            if value is None:
+                if field.required:
+                    raise ValueError(field.name + ': value required')
+                values[field.name] = ''
+            elif field.pattern and not field.pattern.search(value):
+                raise ValueError(field.name + ": '" + value +
+                                 "' does not match " + field.pattern.pattern)
+        for conditions, requirements in self.rules:
+            if all_met(conditions, values) and \
+                    not all_met(requirements, values):
+                raise ValueError('Rule broken: ' + ', '.join(
+                    name + ' must be ' + '/'.join(sorted(allowed))
+                    for name, allowed in requirements) + ' when ' + ', '.join(
+                    name + ' is ' + '/'.join(sorted(allowed))
+                    for name, allowed in conditions))
+        return {field.name: values[field.name] for field in self.fields
+                if not any_met(field.skip_if, values)}
+
+    def ops(self, values):
+        """Browser operations setting the given form values."""
+        # A radio group without a value is left as the page has it
+        return [[field.name, field.type, values[field.name]]
+                for field in self.fields if field.name in values and
+                (values[field.name] or field.type != 'radio')]
+
+    def diff(self, values, read_back):
+        """{field name: [expected, actual]} of the mismatched fields."""
+        diff = {}
+        for name, actual in read_back.items():
+            expected = values[name]
+            if actual is not None:
+                actual = actual.replace('\r\n', '\n')
+            if actual != expected and actual not in self.accept.get(name, ()):
+                diff[name] = [expected, actual]
+        return diff
+
+
+def load_spec(spec_path):
+    with open(spec_path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def compile_spec(spec_path):
+    """Load and compile a spec file into a FillPlan."""
+    return FillPlan(load_spec(spec_path))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check a form spec and '
+                                                 'print the form values it '
+                                                 'gives for an input.')
+    parser.add_argument('spec', metavar='SPEC_PATH', type=str,
+                        help='Form spec JSON file')
+    parser.add_argument('-i', '--input', metavar='INPUT_PATH', type=str,
+                        help='Input file or grant store directory')
+    parser.add_argument('-n', '--pi_name', metavar='PI_NAME', type=str,
+                        default='', help='PI name')
+    parser.add_argument('--input_format', default='auto',
+                        help='Input format (default: guessed from the '
+                             'extension)')
+    parser.add_argument('--version', '-v', action='version',
+                        version='%(prog)s ' + __version__)
+    args = parser.parse_args()
+
+    try:
+        plan = compile_spec(args.spec)
+    except (SpecError, KeyError) as e:
+        sys.exit('Invalid spec: ' + str(e))
+    print(args.spec + ': ' + str(len(plan.fields)) + ' fields, ' +
+          str(len(plan.rules)) + ' rules')
+    if not args.input:
+        return
+
+    import auto_grant_rec
+    errors = 0
+    for i, row in enumerate(auto_grant_rec.load_records(
+            args.input, args.pi_name, args.input_format)):
+        try:
+            values = plan.values(row, {'pi_name': args.pi_name})
+        except (ValueError, KeyError) as e:
+            errors += 1
+            print('Record ' + str(i + 1) + ': ' + str(e))
+            continue
+        print(json.dumps(values, ensure_ascii=False))
+    if errors:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,235 @@
+"""
+RGC application grant record auto-filler (PI-partitioned record store)
+==
+
+Institution-wide grant registers hold thousands of rows across hundreds of
+PIs, whereas `auto_grant_rec.py` only needs the rows of one PI per run. This
+script converts such a register once into an on-disk store, with one
+uncompressed Arrow IPC file per PI and a small JSON index. Each filler run
+(or batch worker) then memory-maps and reads only the slice of its own PI
+instead of re-reading and filtering the whole register.
+
+## Dependencies
+### Python3 packages
+- `pandas`:   table handler
+- `openpyxl`: Excel handler
+- `pyarrow`:  columnar store
+
+Install Python3 package prerequities by
+- `python3 -m pip install pandas openpyxl pyarrow`
+
+## Usage
+- Build the store from a register that has the same sheets and columns as
+  the template, plus one column naming the PI of each row:
+  `python3 auto_grant_rec_store.py -i register.xlsx -o grant_store
+   --pi_column "PI name"`
+- Pass the store directory as input to the filler. Only the slice of the PI
+  given by `-n` is loaded:
+  `python3 auto_grant_rec.py -u USER_ID -p PASSWD -n "CHAN, Tai-man"
+   -c /path/to/chromedriver -i grant_store`
+
+## Remarks
+- PI names are matched case-insensitively and ignoring surrounding quotes
+  and repeated spaces.
+- Rebuild the store whenever the register changes. The store is written to
+  a temporary directory first and swapped in as a whole.
+- `-o` must be a new or empty directory, or an existing store. Other
+  directories are never overwritten.
+"""
+
+__author__ = 'Claire Chung'
+__version__ = '1.3'
+__license__ = "MIT License"
+
+import argparse
+import datetime
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+TEMPLATE_SHEETS = ['On-going', 'Completed', 'Pending']
+INDEX_FILENAME = 'index.json'
+STORE_FORMAT = 1
+
+logger = logging.getLogger(__name__)
+
+
+def pi_key(pi_name):
+    """Normalize a PI name for partition lookup."""
+    return ' '.join(str(pi_name).strip().strip('"').split()).casefold()
+
+
+def _partition_filename(key):
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16] + '.arrow'
+
+
+def _normalize_object_column(series):
+    """
+    Give mixed-type register columns a single string type.
+
+    Excel stores e.g. numeric reference numbers as floats next to textual
+    ones. Integral floats are written without the trailing '.0' so that the
+    filler reads back the same values as from the original workbook.
+    """
+    def convert(value):
+        if value is None or (isinstance(value, float) and value != value):
+            return None
+        if isinstance(value, float) and value.is_integer():
+            return str(int(value))
+        return str(value)
+    return series.map(convert)
+
+
+def _swap_in(new_dir, store_dir):
+    """
+    Replace `store_dir` by `new_dir`. An old store is renamed aside first
+    and only deleted once the new one is in place.
+    """
+    if not os.path.isdir(store_dir):
+        os.replace(new_dir, store_dir)
+        return
+    if not os.listdir(store_dir):
+        os.rmdir(store_dir)
+        os.replace(new_dir, store_dir)
+        return
+    old_dir = tempfile.mkdtemp(prefix='.grant-store-old-',
+                               dir=os.path.dirname(os.path.abspath(store_dir)))
+    os.rmdir(old_dir)
+    os.replace(store_dir, old_dir)
+    try:
+        os.replace(new_dir, store_dir)
+    except BaseException:
+        os.replace(old_dir, store_dir)
+        raise
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def build_store(register_path, store_dir, pi_column='PI name',
+                sheets=TEMPLATE_SHEETS):
+    """
+    Convert an institution-wide register into a PI-partitioned store.
+
+    Returns the index written to `store_dir`.
+    """
+    import pandas as pd
+    import pyarrow as pa
+
+    if os.path.exists(store_dir) and not (
+            os.path.isdir(store_dir) and
+            (is_store(store_dir) or not os.listdir(store_dir))):
+        raise ValueError(store_dir + " exists and is not a grant store. "
+                         "Please choose a new or empty directory.")
+
+    df = pd.concat(pd.read_excel(register_path, sheet_name=list(sheets)))
+    df = df.reset_index(drop=True)
+    if pi_column not in df.columns:
+        raise KeyError("PI column '" + pi_column + "' not found in " +
+                       register_path)
+    df = df.loc[~df[pi_column].isna()]
+    for column in df.columns:
+        if df[column].dtype == object:
+            df[column] = _normalize_object_column(df[column])
+
+    index = {'format': STORE_FORMAT,
+             'source': os.path.abspath(register_path),
+             'source_mtime': os.path.getmtime(register_path),
+             'created': datetime.datetime.now().isoformat(timespec='seconds'),
+             'pi_column': pi_column,
+             'columns': [str(c) for c in df.columns if c != pi_column],
+             'partitions': {}}
+
+    parent_dir = os.path.dirname(os.path.abspath(store_dir))
+    tmp_dir = tempfile.mkdtemp(prefix='.grant-store-', dir=parent_dir)
+    try:
+        keys = df[pi_column].map(pi_key)
+        for key, part in df.groupby(keys, sort=True):
+            filename = _partition_filename(key)
+            table = pa.Table.from_pandas(
+                part.drop(columns=[pi_column]).reset_index(drop=True),
+                preserve_index=False)
+            # Uncompressed IPC files can be memory-mapped without copying
+            with pa.OSFile(os.path.join(tmp_dir, filename), 'wb') as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+            index['partitions'][key] = {
+                'pi_name': str(part[pi_column].iloc[0]).strip(),
+                'file': filename,
+                'rows': len(part)}
+        with open(os.path.join(tmp_dir, INDEX_FILENAME), 'w',
+                  encoding='utf-8') as f:
+            json.dump(index, f, indent=1, ensure_ascii=False)
+        _swap_in(tmp_dir, store_dir)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    logger.info("Store written to " + store_dir + " with " +
+                str(len(index['partitions'])) + " PIs and " +
+                str(len(df)) + " records.")
+    return index
+
+
+def is_store(path):
+    return os.path.isfile(os.path.join(path, INDEX_FILENAME))
+
+
+def read_index(store_dir):
+    with open(os.path.join(store_dir, INDEX_FILENAME), encoding='utf-8') as f:
+        index = json.load(f)
+    if index.get('format') != STORE_FORMAT:
+        raise ValueError("Unsupported grant store format in " + store_dir +
+                         ". Please rebuild the store.")
+    return index
+
+
+def load_pi_slice(store_dir, pi_name):
+    """Memory-map and return the records of one PI as an Arrow table."""
+    import pyarrow as pa
+
+    index = read_index(store_dir)
+    try:
+        partition = index['partitions'][pi_key(pi_name)]
+    except KeyError:
+        raise KeyError("PI '" + str(pi_name) + "' not found in grant store " +
+                       store_dir) from None
+    source = pa.memory_map(os.path.join(store_dir, partition['file']), 'r')
+    return pa.ipc.open_file(source).read_all()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert an institution-wide '
+                                                 'grant register into a '
+                                                 'PI-partitioned record store.')
+    parser.add_argument('-i', '--input', metavar='EXCEL_FILE_PATH', type=str,
+                        help='Input register Excel file')
+    parser.add_argument('-o', '--output', metavar='STORE_DIR', type=str,
+                        required=True, help='Output store directory')
+    parser.add_argument('--pi_column', metavar='COLUMN', type=str,
+                        default='PI name',
+                        help='Register column holding the PI name')
+    parser.add_argument('--sheets', metavar='SHEET', nargs='+',
+                        default=TEMPLATE_SHEETS,
+                        help='Register sheets to ingest')
+    parser.add_argument('--list', action='store_true',
+                        help='List the PIs of an existing store and exit')
+    parser.add_argument('--version', '-v', action='version',
+                        version='%(prog)s ' + __version__)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.list:
+        for partition in read_index(args.output)['partitions'].values():
+            print(partition['pi_name'] + '\t' + str(partition['rows']))
+        return
+    if not args.input:
+        parser.error('the following arguments are required: -i/--input')
+    try:
+        build_store(args.input, args.output, args.pi_column, args.sheets)
+    except ValueError as e:
+        parser.error(str(e))
+
+
+if __name__ == '__main__':
+    main()
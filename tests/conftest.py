@@ -0,0 +1,61 @@
+import datetime
+import os
+import sys
+
+# The scripts are top-level modules of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import auto_grant_rec  # noqa: E402
+
+
+def make_row(**changes):
+    """A grant record row as read from the input template."""
+    row = {'Reference number': 'GRF12345',
+           'Project title': 'A study',
+           'Role': 'PI',
+           'Funding source': 'GRF',
+           'Amount (HK$)': 100000.0,
+           'UGC/RGC funding': 'Y',
+           'Start date': datetime.datetime(2020, 1, 2),
+           'End date': datetime.datetime(2022, 3, 4),
+           'Number of hours': 5.0,
+           'Status': 'On-going',
+           'Project Objectives': 'To study.'}
+    row.update(changes)
+    return row
+
+
+class FakeSession(auto_grant_rec.RGCSession):
+    """
+    RGCSession keeping the saved records as form values in a list instead
+    of driving a browser.
+    """
+
+    def __init__(self, saved=()):
+        self.saved = [dict(values) for values in saved]
+        self.deleted = []
+        self.filled = []
+
+    def record_buttons(self):
+        return [[None, values.get('ref_no') or 'REC%05d' % position]
+                for position, values in enumerate(self.saved)]
+
+    def read_saved_record(self, position):
+        return dict(self.saved[position])
+
+    def delete_record(self, position):
+        self.deleted.append(self.saved.pop(position))
+
+    def clear_records_bulk(self):
+        cleared = len(self.saved)
+        self.deleted.extend(self.saved)
+        self.saved = []
+        return cleared
+
+    def fill_record(self, inputdict, verify=True):
+        self.filled.append(inputdict)
+        self.saved.append(auto_grant_rec.expected_form_values(inputdict))
+
+    def fill_planned(self, plan, values):
+        self.filled.append(values)
+        self.saved.append(dict(values))
@@ -0,0 +1,105 @@
+import json
+import time
+
+import pytest
+
+import auto_grant_rec_batch as batch
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return batch.JobQueue(str(tmp_path / 'jobs.db'))
+
+
+def add_job(queue, max_attempts=3):
+    return queue.add('user', 'RGC_PW', 'CHAN Tai Man', 'chan.xlsx',
+                     ['--clear', 'bulk'], max_attempts=max_attempts)
+
+
+def status(queue, job_id):
+    return {job['id']: job for job in queue.jobs()}[job_id]
+
+
+def test_claim_marks_job_running_once(queue):
+    job_id = add_job(queue)
+    job = queue.claim()
+    assert job['id'] == job_id
+    assert json.loads(job['options']) == ['--clear', 'bulk']
+    assert status(queue, job_id)['status'] == 'running'
+    assert status(queue, job_id)['attempts'] == 1
+    assert queue.claim() is None
+
+
+def test_claim_takes_jobs_in_order(queue):
+    first, second = add_job(queue), add_job(queue)
+    assert [queue.claim()['id'], queue.claim()['id']] == [first, second]
+
+
+def test_fail_queues_job_again_after_delay(queue):
+    job_id = add_job(queue)
+    queue.claim()
+    queue.fail(job_id, 'TimeoutException()', 60)
+    job = status(queue, job_id)
+    assert job['status'] == 'queued'
+    assert job['last_error'] == 'TimeoutException()'
+    assert job['next_run'] > time.time() + 50
+    assert queue.claim() is None
+    assert 50 < queue.next_wait() <= 60
+
+
+def test_fail_without_attempts_left_fails_job(queue):
+    job_id = add_job(queue, max_attempts=2)
+    for _ in range(2):
+        assert queue.claim()['id'] == job_id
+        queue.fail(job_id, 'error', 0)
+    assert status(queue, job_id)['status'] == 'failed'
+    assert queue.claim() is None
+    assert queue.next_wait() is None
+
+
+def test_requeue_gives_failed_jobs_fresh_attempts(queue):
+    job_id = add_job(queue, max_attempts=1)
+    queue.claim()
+    queue.fail(job_id, 'error', 0)
+    assert queue.requeue() == 1
+    job = status(queue, job_id)
+    assert (job['status'], job['attempts']) == ('queued', 0)
+    assert queue.claim()['id'] == job_id
+
+
+def test_complete_stores_result(queue):
+    job_id = add_job(queue)
+    queue.claim()
+    assert queue.next_wait() == 0.0
+    queue.complete(job_id, {'cleared': 2, 'filled': 3})
+    job = status(queue, job_id)
+    assert job['status'] == 'done'
+    assert json.loads(job['result']) == {'cleared': 2, 'filled': 3}
+    assert queue.counts() == {'done': 1}
+    assert queue.next_wait() is None
+
+
+def test_token_bucket_allows_burst_then_rate():
+    bucket = batch.TokenBucket(rate=20, burst=2)
+    start = time.monotonic()
+    bucket.acquire()
+    bucket.acquire()
+    assert time.monotonic() - start < 0.04
+    bucket.acquire()
+    bucket.acquire()
+    assert time.monotonic() - start >= 0.09
+
+
+def test_retry_delay_backs_off_up_to_cap():
+    assert 15 <= batch.retry_delay(1) <= 45
+    assert 60 <= batch.retry_delay(3) <= 180
+    assert batch.retry_delay(20) <= 900 * 1.5
+
+
+def test_parse_job_args_rejects_bad_options():
+    args = batch.parse_job_args('user', 'pw', 'CHAN Tai Man', 'chan.xlsx',
+                                ['--clear', 'bulk'])
+    assert args.clear == 'bulk'
+    with pytest.raises(SystemExit):
+        batch.parse_job_args('user', 'pw', 'CHAN Tai Man', 'chan.xlsx',
+                             ['--clear', 'sometimes'])
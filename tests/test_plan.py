@@ -0,0 +1,129 @@
+import json
+
+import pytest
+
+import auto_grant_rec_plan as planner
+
+
+def write_log(path, entries):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('not a JSON line\n')
+        for entry in entries:
+            f.write(json.dumps(entry) + '\n')
+    return str(path)
+
+
+def run_entries(records, chars):
+    """Log entries of one run filling `records` records of `chars` chars."""
+    entries = [{'message': 'Phase login', 'phase': 'login', 'elapsed': 10.0},
+               {'message': 'Phase clear', 'phase': 'clear',
+                'elapsed': 2.0 + 1.0 * records, 'records': records}]
+    for _ in range(records):
+        entries.append({'message': 'Record filled', 'phase': 'record',
+                        'elapsed': 3.0 + 0.01 * chars, 'chars': chars})
+    entries.append({'message': 'Phase verify', 'phase': 'verify',
+                    'elapsed': 1.0 + 4.0 * records, 'records': records})
+    entries.append({'message': 'Phase check', 'phase': 'check',
+                    'elapsed': 5.0})
+    return entries
+
+
+@pytest.fixture
+def model(tmp_path):
+    model = planner.CostModel()
+    model.read_log(write_log(tmp_path / 'a.log', run_entries(2, 100)))
+    model.read_log(write_log(tmp_path / 'b.log', run_entries(4, 300)))
+    return model.fit()
+
+
+def test_linear_fit():
+    assert planner.linear_fit([(1, 3), (2, 5), (3, 7)]) == \
+        pytest.approx((1, 2))
+    assert planner.linear_fit([(2, 4), (2, 6)]) == (5, 0.0)
+    assert planner.linear_fit([(1, 6), (2, 4)]) == (5, 0.0)
+    assert planner.linear_fit([]) == (0.0, 0.0)
+
+
+def test_fit(model):
+    c = model.coefficients
+    assert model.runs == 2
+    assert c['login'] == pytest.approx(10)
+    assert c['check'] == pytest.approx(5)
+    assert (c['clear_run'], c['clear_record']) == pytest.approx((2, 1))
+    assert (c['verify_run'], c['verify_record']) == pytest.approx((1, 4))
+    assert (c['fill_record'], c['fill_char']) == pytest.approx((3, 0.01))
+
+
+def test_fit_needs_login(tmp_path):
+    model = planner.CostModel()
+    model.read_log(write_log(tmp_path / 'a.log', run_entries(2, 100)[1:]))
+    with pytest.raises(ValueError, match='No login phase'):
+        model.fit()
+
+
+def test_fit_from_profile_report(tmp_path):
+    path = tmp_path / 'profile.json'
+    path.write_text(json.dumps({'phases': {
+        'login': {'seconds': 8.0},
+        'fill': {'seconds': 12.0, 'records': 4}}}))
+    model = planner.CostModel()
+    model.read_log(str(path))
+    c = model.fit().coefficients
+    assert (c['fill_record'], c['fill_char']) == (3.0, 0.0)
+
+
+def test_predict(model):
+    phases = model.predict([100, 200], existing=1)
+    assert phases == pytest.approx({'login': 10, 'clear': 3, 'fill': 9,
+                                    'check': 5})
+    assert model.predict([100, 200], verify=True)['verify'] == \
+        pytest.approx(9)
+
+
+def test_makespan():
+    assert planner.makespan([3, 3, 2, 2], 2) == 5
+    assert planner.makespan([3, 3, 2, 2], 1) == 10
+    assert planner.makespan([3, 3, 2, 2], 8) == 3
+
+
+def test_recommend_smallest_worker_count_near_best():
+    jobs = [{'seconds': 100, 'transitions': 10}] * 4
+    workers, rate, seconds = planner.recommend(jobs, max_workers=8,
+                                               max_rate=10)
+    assert (workers, seconds) == (4, 100)
+    assert rate == pytest.approx(0.4)
+
+
+def test_recommend_bounded_by_rate_limit():
+    jobs = [{'seconds': 100, 'transitions': 100}] * 4
+    workers, rate, seconds = planner.recommend(jobs, max_workers=4,
+                                               max_rate=2)
+    assert (workers, rate, seconds) == (2, 2, 200)
+
+
+def write_input(path, n):
+    with open(path, 'w', encoding='utf-8') as f:
+        for i in range(n):
+            f.write(json.dumps({
+                'Reference number': 'REF%04d' % i, 'Project title': 'Study',
+                'Role': 'PI', 'Funding source': 'GRF', 'Amount (HK$)': 1000,
+                'UGC/RGC funding': 'Y', 'Start date': '2024-01-01',
+                'End date': '2099-12-31', 'Number of hours': 2,
+                'Status': 'On-going', 'Project Objectives': 'To study.'})
+                + '\n')
+    return str(path)
+
+
+def test_predict_counts_transitions(model, tmp_path):
+    input_path = write_input(tmp_path / 'records.jsonl', 3)
+    inline = planner.job_options(input_path, 'CHAN Tai Man')
+    deferred = planner.job_options(input_path, 'CHAN Tai Man',
+                                   ['--verify', 'deferred'])
+    plan = planner.predict(model, [inline, deferred], existing=0)
+    first, second = plan['jobs']
+    assert first['records'] == 3
+    assert first['transitions'] == planner.login_transitions + \
+        planner.record_transitions * 3
+    assert second['transitions'] == first['transitions'] + \
+        planner.verify_transitions * 3
+    assert 'verify' in second['phases'] and 'verify' not in first['phases']
@@ -0,0 +1,148 @@
+import copy
+import datetime
+import os
+
+import pytest
+
+import auto_grant_rec_spec as spec_module
+from auto_grant_rec_spec import FillPlan, SpecError
+
+spec_path = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'grant_record_spec.json')
+params = {'pi_name': 'CHAN Tai Man'}
+
+
+@pytest.fixture
+def spec():
+    return spec_module.load_spec(spec_path)
+
+
+@pytest.fixture
+def plan(spec):
+    return FillPlan(spec)
+
+
+def make_row(**changes):
+    row = {'Reference number': 12345.0,
+           'Project title': 'A study',
+           'Role': 'PI',
+           'Funding source': 'GRF',
+           'Amount (HK$)': 100000.0,
+           'UGC/RGC funding': 'Y',
+           'Start date': datetime.datetime(2020, 1, 2),
+           'End date': datetime.datetime(2022, 3, 4),
+           'Number of hours': 5.0,
+           'Status': 'On-going',
+           'Project Objectives': 'To study.'}
+    row.update(changes)
+    return row
+
+
+def test_values_of_grf_record(plan):
+    assert plan.values(make_row(), params) == {
+        'piName': 'CHAN Tai Man', 'capacity': 'P', 'fund_src_flag': 'Y',
+        'proj_status': 'O', 'ref_no': '12345', 'proj_title': 'A study',
+        'fund_amt': '100000', 'ugcfunding': 'Y', 's_day': '2',
+        's_month': '1', 's_year': '2020', 'c_day': '4', 'c_month': '3',
+        'c_year': '2022', 'workHourPer': '5',
+        'projectObjective': 'To study.', 'overlap': 'NA'}
+
+
+def test_values_keep_order_of_spec(plan, spec):
+    names = [field['name'] for field in spec['fields']]
+    assert list(plan.values(make_row(), params)) == \
+        [name for name in names if name != 'fund_src']
+
+
+def test_unmapped_funding_source_uses_map_default(plan):
+    values = plan.values(make_row(**{'Funding source': 'Other Fund',
+                                     'UGC/RGC funding': 'N'}), params)
+    assert values['fund_src_flag'] == 'N'
+    assert values['fund_src'] == 'Other Fund'
+
+
+def test_text_reference_number_is_kept(plan):
+    values = plan.values(make_row(**{'Reference number': 'AB-123'}), params)
+    assert values['ref_no'] == 'AB-123'
+
+
+def test_pending_record_defaults_amount_and_skips_hours(plan):
+    values = plan.values(make_row(**{'Status': 'Pending',
+                                     'Amount (HK$)': float('nan')}), params)
+    assert values['fund_amt'] == '0'
+    assert 'workHourPer' not in values
+
+
+def test_default_not_allowed_outside_default_if(plan):
+    with pytest.raises(ValueError, match='fund_amt'):
+        plan.values(make_row(**{'Amount (HK$)': float('nan')}), params)
+
+
+def test_co_investigator_skips_hours(plan):
+    values = plan.values(make_row(Role='Co-I'), params)
+    assert values['capacity'] == 'C'
+    assert 'workHourPer' not in values
+
+
+def test_missing_required_value(plan):
+    with pytest.raises(ValueError, match='proj_status: value required'):
+        plan.values(make_row(Status=float('nan')), params)
+
+
+def test_unknown_mapped_value(plan):
+    with pytest.raises(ValueError, match="capacity: no mapping for 'Boss'"):
+        plan.values(make_row(Role='Boss'), params)
+
+
+def test_pattern_mismatch(plan):
+    with pytest.raises(ValueError, match='ugcfunding'):
+        plan.values(make_row(**{'UGC/RGC funding': 'Yes'}), params)
+
+
+def test_rule_broken(plan):
+    with pytest.raises(ValueError, match='Rule broken: ugcfunding must be Y'):
+        plan.values(make_row(**{'UGC/RGC funding': 'N'}), params)
+
+
+def test_missing_column(plan):
+    row = make_row()
+    del row['Status']
+    with pytest.raises(KeyError):
+        plan.values(row, params)
+
+
+def test_ops_leave_radio_without_value(plan):
+    values = plan.values(make_row(), params)
+    values['ugcfunding'] = ''
+    ops = plan.ops(values)
+    assert ['capacity', 'select', 'P'] in ops
+    assert ['overlap', 'radio', 'NA'] in ops
+    assert 'ugcfunding' not in [op[0] for op in ops]
+
+
+def test_diff(plan):
+    values = {'fund_amt': '100', 'proj_title': 'A\nB', 'ref_no': '1',
+              'capacity': 'P'}
+    read_back = {'fund_amt': '0', 'proj_title': 'A\r\nB', 'ref_no': '1',
+                 'capacity': None}
+    assert plan.diff(values, read_back) == {'capacity': ['P', None]}
+    assert plan.diff({'ref_no': '123'}, {'ref_no': '12'}) == \
+        {'ref_no': ['123', '12']}
+
+
+@pytest.mark.parametrize('change, message', [
+    (lambda s: s.pop('form'), "no 'form'"),
+    (lambda s: s['form'].update(open=['tag', 'a']), "locator 'open'"),
+    (lambda s: s['fields'].append(dict(s['fields'][0])), 'unique name'),
+    (lambda s: s['fields'][0].update(type='checkbox'), 'unknown type'),
+    (lambda s: s['fields'][0].update(column='Name'), 'exactly one of'),
+    (lambda s: s['fields'][1].update(format='roman'), 'unknown format'),
+    (lambda s: s['fields'][1].update(map='roles'), 'unknown map roles'),
+    (lambda s: s['rules'].append({'if': {'colour': ['red']}}),
+     'unknown field colour'),
+])
+def test_invalid_spec(spec, change, message):
+    spec = copy.deepcopy(spec)
+    change(spec)
+    with pytest.raises(SpecError, match=message):
+        FillPlan(spec)
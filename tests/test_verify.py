@@ -0,0 +1,75 @@
+from conftest import FakeSession, make_row
+
+from auto_grant_rec import build_inputdict, expected_form_values
+
+pi_name = 'CHAN Tai Man'
+
+
+def inputdicts(*rows):
+    return [build_inputdict(row, pi_name) for row in rows]
+
+
+def saved(inputdict, **changes):
+    values = expected_form_values(inputdict)
+    values.update(changes)
+    return values
+
+
+def test_all_saved_records_verified():
+    inputs = inputdicts(make_row(), make_row(**{'Reference number': 'B2'}))
+    session = FakeSession([saved(d) for d in reversed(inputs)])
+    assert session.verify_records(inputs) == []
+    assert session.deleted == [] and session.filled == []
+
+
+def test_mismatched_record_resubmitted():
+    inputs = inputdicts(make_row(), make_row(**{'Reference number': 'B2'}))
+    session = FakeSession([saved(inputs[0]),
+                           saved(inputs[1], proj_title='A stud')])
+    diff = session.verify_records(inputs)
+    assert diff == [{'record': 1, 'ref_no': 'B2', 'position': 1,
+                     'fields': {'proj_title': ['A study', 'A stud']}}]
+    assert [values['proj_title'] for values in session.deleted] == ['A stud']
+    assert session.filled == [inputs[1]]
+
+
+def test_missing_record_resubmitted():
+    inputs = inputdicts(make_row(), make_row(**{'Reference number': 'B2'}))
+    session = FakeSession([saved(inputs[0])])
+    diff = session.verify_records(inputs)
+    assert [(d['record'], d['position']) for d in diff] == [(1, None)]
+    assert session.filled == [inputs[1]]
+
+
+def test_unique_reference_number_pairs_before_closest_match():
+    # The saved copy of the first record lost most fields, so that the
+    # closest match would pair the first input with the saved second one
+    inputs = inputdicts(make_row(**{'Project title': 'Renewal'}),
+                        make_row(**{'Reference number': 'B2'}))
+    broken = saved(inputs[0], proj_title='', capacity='', proj_status='',
+                   fund_amt='', s_day='', s_month='', s_year='', c_day='',
+                   c_month='', c_year='', projectObjective='')
+    session = FakeSession([saved(inputs[1]), broken])
+    diff = session.verify_records(inputs)
+    assert [(d['record'], d['position']) for d in diff] == [(0, 1)]
+    assert session.deleted == [broken]
+    assert session.saved == [saved(inputs[1]), saved(inputs[0])]
+
+
+def test_stray_saved_record_deleted():
+    inputs = inputdicts(make_row())
+    stray = saved(inputdicts(make_row(**{'Reference number': 'OLD1',
+                                         'Project title': 'Old'}))[0])
+    session = FakeSession([stray, saved(inputs[0])])
+    assert session.verify_records(inputs) == []
+    assert session.deleted == [stray]
+    assert session.saved == [saved(inputs[0])]
+
+
+def test_locate_records_confirms_shared_reference_number():
+    first, second = inputdicts(make_row(**{'Project title': 'Renewal 1'}),
+                               make_row(**{'Project title': 'Renewal 2'}))
+    session = FakeSession([saved(first)])
+    assert session.locate_records([saved(second)]) == [0]
+    assert session.locate_records([saved(second)], confirm=True) is None
+    assert session.locate_records([saved(first)], confirm=True) == [0]
@@ -0,0 +1,107 @@
+import types
+
+from selenium.common.exceptions import WebDriverException
+
+import auto_grant_rec
+from auto_grant_rec import push_changes, watch_entries
+from conftest import FakeSession, make_row
+
+pi_name = 'CHAN Tai Man'
+
+
+class FakeWorker:
+    def __init__(self, session):
+        self.session = session
+        self.recycled = []
+
+    def fill_record(self, inputdict, verify=True):
+        self.session.fill_record(inputdict, verify)
+
+    def fill_planned(self, plan, values):
+        self.session.fill_planned(plan, values)
+
+    def recycle(self, reason):
+        self.recycled.append(reason)
+        self.session = FakeSession(self.session.saved)
+
+
+def entries(*rows):
+    return watch_entries(list(rows), pi_name)
+
+
+def synced(current):
+    """Worker whose session holds the records of the current entries."""
+    return FakeWorker(FakeSession([expected for _, _, expected in current]))
+
+
+rows = [make_row(**{'Reference number': 'A%d' % i}) for i in range(3)]
+
+
+def test_unchanged_input_pushes_nothing():
+    current = entries(*rows)
+    worker = synced(current)
+    assert push_changes(worker, current, entries(*rows)) == (0, 0)
+    assert worker.session.filled == []
+
+
+def test_changed_record_deleted_and_added():
+    current = entries(*rows)
+    worker = synced(current)
+    changed = make_row(**{'Reference number': 'A1', 'Project title': 'New'})
+    new = entries(rows[0], changed, rows[2])
+    assert push_changes(worker, current, new) == (1, 1)
+    assert worker.session.deleted == [current[1][2]]
+    assert sorted(map(auto_grant_rec.record_key, worker.session.saved)) == \
+        sorted(key for key, _, _ in new)
+
+
+def test_duplicate_records_counted():
+    current = entries(rows[0], rows[0])
+    worker = synced(current)
+    assert push_changes(worker, current, entries(rows[0])) == (1, 0)
+    assert len(worker.session.saved) == 1
+
+
+def test_records_not_found_filled_again():
+    current = entries(*rows)
+    # Saved records differing from what the last push left
+    worker = synced(entries(rows[0]))
+    new = entries(rows[0], rows[2])
+    assert push_changes(worker, current, new) == (1, 2)
+    assert sorted(map(auto_grant_rec.record_key, worker.session.saved)) == \
+        sorted(key for key, _, _ in new)
+
+
+def test_failed_push_resyncs(monkeypatch):
+    current = entries(*rows)
+    worker = synced(current)
+    changes = iter([[rows[0]]])
+
+    class Watcher:
+        observer = None
+
+        def __init__(self, path):
+            pass
+
+        def wait(self):
+            # One change, then Ctrl-C
+            if not hasattr(self, 'changed'):
+                self.changed = True
+                return
+            raise KeyboardInterrupt
+
+        def stop(self):
+            pass
+
+    def failing_push(*args):
+        raise WebDriverException('browser gone')
+
+    monkeypatch.setattr(auto_grant_rec, 'InputWatcher', Watcher)
+    monkeypatch.setattr(auto_grant_rec, 'load_records',
+                        lambda *args: next(changes))
+    monkeypatch.setattr(auto_grant_rec, 'push_changes', failing_push)
+    args = types.SimpleNamespace(input='records.xlsx', pi_name=pi_name,
+                                 input_format='auto')
+    auto_grant_rec.watch_input(worker, args, rows)
+    assert worker.recycled == ['push failed']
+    assert worker.session.saved == [current[0][2]]